@@ -0,0 +1,118 @@
+import time
+import shelve
+import hashlib
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    '''
+    A size-bounded cache which evicts the least recently used entry.
+    Every entry has its own time-to-live in seconds.
+    The ttl None means the entry never expires.
+    '''
+    def __init__(self, maxsize=100, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.container = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        May throw KeyError
+        '''
+        try:
+            expire_at, value = self.container.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        if expire_at is not None and expire_at <= self.clock():
+            self.misses += 1
+            raise KeyError(key)
+        self.container[key] = (expire_at, value)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, ttl=None):
+        self.container.pop(key, None)
+        self.container[key] = (expire_time(self.clock, ttl), value)
+        while len(self.container) > self.maxsize:
+            self.container.popitem(last=False)
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        while len(self.container) > self.maxsize:
+            self.container.popitem(last=False)
+
+    def clear(self):
+        self.container.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.container)
+
+
+class DiskCache(object):
+    '''
+    A persistent cache stored in a shelve file.
+    <key> must be a string. The values must be picklable.
+    '''
+    def __init__(self, filename, clock=time.time):
+        self.filename = filename
+        self.clock = clock
+        self.shelf = shelve.open(filename)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        May throw KeyError
+        '''
+        hkey = hash_key(key)
+        try:
+            expire_at, value = self.shelf[hkey]
+        except KeyError:
+            self.misses += 1
+            raise
+        if expire_at is not None and expire_at <= self.clock():
+            del self.shelf[hkey]
+            self.misses += 1
+            raise KeyError(key)
+        self.hits += 1
+        return value
+
+    def ttl(self, key):
+        '''
+        Returns the remaining time-to-live of <key>. May throw KeyError.
+        '''
+        expire_at, _ = self.shelf[hash_key(key)]
+        if expire_at is None:
+            return None
+        return expire_at - self.clock()
+
+    def put(self, key, value, ttl=None):
+        self.shelf[hash_key(key)] = (expire_time(self.clock, ttl), value)
+        self.shelf.sync()
+
+    def clear(self):
+        self.shelf.clear()
+        self.shelf.sync()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self):
+        self.shelf.close()
+
+    def __len__(self):
+        return len(self.shelf)
+
+
+def expire_time(clock, ttl):
+    if ttl is None:
+        return None
+    return clock() + ttl
+
+
+def hash_key(key):
+    return hashlib.sha1(key).hexdigest()
@@ -1,5 +1,7 @@
 #
 
+import pprint
+
 
 class Table(dict):
 
@@ -49,3 +51,118 @@ class Buckets(object):
 
     def __iter__(self):
         return iter(self.container)
+
+
+class TableView(object):
+    '''
+    A read-only view of a dict which gives the same attribute access
+    as Table. Nested dicts and lists are wrapped only when they are
+    touched, so nothing is copied.
+    Use unwrap() to get the underlying data.
+    '''
+    __slots__ = ('__data',)
+
+    def __init__(self, data):
+        if not isinstance(data, dict):
+            raise TypeError(
+                'Expect data to be a dict but found %s' % type(data))
+        self.__data = data
+
+    def __getattr__(self, name):
+        try:
+            return view(self.__data[name])
+        except KeyError:
+            raise AttributeError('Attribute "%s" not found' % name)
+
+    def __getitem__(self, key):
+        return view(self.__data[key])
+
+    def get(self, key, default=None):
+        return view(self.__data.get(key, default))
+
+    def __contains__(self, key):
+        return key in self.__data
+
+    def __iter__(self):
+        return iter(self.__data)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def keys(self):
+        return self.__data.keys()
+
+    def values(self):
+        return map(view, self.__data.values())
+
+    def items(self):
+        return map(lambda (k, v): (k, view(v)), self.__data.items())
+
+    def iteritems(self):
+        for k, v in self.__data.iteritems():
+            yield k, view(v)
+
+    def __eq__(self, other):
+        return self.__data == unwrap(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.__data)
+
+    def __str__(self):
+        return pprint.pformat(self.__data)
+
+
+class ListView(object):
+    '''
+    A read-only view of a list whose elements are wrapped
+    only when they are touched.
+    '''
+    __slots__ = ('__data',)
+
+    def __init__(self, data):
+        self.__data = data
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return ListView(self.__data[i])
+        return view(self.__data[i])
+
+    def __iter__(self):
+        for e in self.__data:
+            yield view(e)
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __eq__(self, other):
+        return self.__data == unwrap(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.__data)
+
+    def __str__(self):
+        return pprint.pformat(self.__data)
+
+
+def view(v):
+    if isinstance(v, dict):
+        return TableView(v)
+    elif isinstance(v, list):
+        return ListView(v)
+    else:
+        return v
+
+
+def unwrap(v):
+    if isinstance(v, TableView):
+        return v._TableView__data
+    elif isinstance(v, ListView):
+        return v._ListView__data
+    else:
+        return v
@@ -0,0 +1,30 @@
+import importlib
+
+
+class LazyModule(object):
+    '''
+    A stand-in for the module <name> which is imported
+    when one of its attributes is used the first time.
+    '''
+    def __init__(self, name):
+        self.__dict__['_LazyModule__name'] = name
+        self.__dict__['_LazyModule__module'] = None
+
+    def __load(self):
+        if self.__module is None:
+            self.__dict__['_LazyModule__module'] = \
+                importlib.import_module(self.__name)
+        return self.__module
+
+    def __getattr__(self, attr):
+        return getattr(self.__load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self.__load(), attr, value)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self.__name
+
+
+def lazy_import(name):
+    return LazyModule(name)
@@ -0,0 +1,60 @@
+import sys
+import time
+import __builtin__
+
+
+class StartupTrace(object):
+    '''
+    Records the time spent importing each module and in each
+    initialization phase.
+    The time of a module includes the modules it imports (cumulative)
+    and the self time excludes them.
+    '''
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.start = clock()
+        self.records = []  # [kind, name, cumulative, self]
+        self.stack = []  # the records being timed
+        self.original_import = None
+
+    def install(self):
+        self.original_import = __builtin__.__import__
+        __builtin__.__import__ = self.traced_import
+
+    def uninstall(self):
+        if self.original_import is not None:
+            __builtin__.__import__ = self.original_import
+            self.original_import = None
+
+    def traced_import(self, name, *args, **kwargs):
+        # only the first import of a module costs something
+        if name in sys.modules:
+            return self.original_import(name, *args, **kwargs)
+        return self.timed('import', name, self.original_import,
+                          name, *args, **kwargs)
+
+    def timed(self, kind, name, func, *args, **kwargs):
+        record = [kind, name, 0, 0]
+        self.records.append(record)
+        self.stack.append(record)
+        start = self.clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = self.clock() - start
+            self.stack.pop()
+            record[2] = elapsed
+            record[3] += elapsed
+            if self.stack:
+                self.stack[-1][3] -= elapsed
+
+    def report(self):
+        total = self.clock() - self.start
+        lines = ['Startup time: %.6fs' % total,
+                 '%-8s %-36s %12s %12s' % (
+                     'kind', 'name', 'self', 'cumulative')]
+        for kind, name, cumulative, self_time in sorted(
+                self.records, key=lambda r: r[3], reverse=True):
+            lines.append('%-8s %-36s %12.6f %12.6f' % (
+                kind, name, self_time, cumulative))
+        return '\n'.join(lines) + '\n'
@@ -2,14 +2,187 @@ import json
 
 from datetime import datetime
 
+# The fastest available backends are selected at import time.
+# ujson cannot call back for datetime, so it is only used for decoding.
+try:
+    import simplejson as json_backend
+except ImportError:
+    json_backend = json
 
-def dumps(data):
-    def the_default(data):
-        if isinstance(data, datetime):
-            return data.isoformat()
+try:
+    import ujson
+    _loads = ujson.loads
+    decoder_name = 'ujson'
+except ImportError:
+    _loads = json_backend.loads
+    decoder_name = json_backend.__name__
 
-    return json.dumps(data, default=the_default)
+encoder_name = json_backend.__name__
+
+
+# Neither json nor simplejson encodes datetimes natively, so they are
+# encoded by this hook, which is called once per datetime.
+def _default(data):
+    if isinstance(data, datetime):
+        return data.isoformat()
+
+
+_encoder = json_backend.JSONEncoder(default=_default)
+_sorted_encoder = json_backend.JSONEncoder(default=_default, sort_keys=True)
+
+
+def dumps(data, sort_keys=False):
+    if sort_keys:
+        return _sorted_encoder.encode(data)
+    return _encoder.encode(data)
 
 
 def loads(s):
-    return json.load(s)
+    '''
+    <s> can be a string or a file-like object.
+    '''
+    if hasattr(s, 'read'):
+        s = s.read()
+    return _loads(s)
+
+
+class ESSerializer(object):
+    '''
+    A serializer for the elasticsearch client which uses
+    the same backend as dumps and loads.
+    '''
+    mimetype = 'application/json'
+
+    def loads(self, s):
+        return loads(s)
+
+    def dumps(self, data):
+        # don't serialize strings
+        if isinstance(data, basestring):
+            return data
+        return dumps(data)
+
+
+JSON_WHITESPACE = ' \t\n\r'
+
+
+class ArrayNotFoundError(ValueError):
+    '''
+    Raised by ArrayStream when the document has no array at its path,
+    e.g. when it is an error. <document> is the decoded document.
+    '''
+    def __init__(self, path, document):
+        ValueError.__init__(
+            self, 'No array at %s in %s' % ('.'.join(path), document))
+        self.path = path
+        self.document = document
+
+
+class ArrayStream(object):
+    '''
+    Decode a JSON document incrementally from <chunks>, an iterable of
+    strings (e.g. the content of a response read from the socket).
+    Iterating over it yields the elements of the array at <path>
+    (a list of keys) one by one, so only one element is decoded at a time.
+    After the iteration, <rest> is the document with that array emptied.
+    ArrayNotFoundError is raised if there is no array at <path>.
+    '''
+    def __init__(self, chunks, path):
+        self.chunks = iter(chunks)
+        self.path = list(path)
+        self.decoder = json_backend.JSONDecoder()
+        self.buf = ''
+        self.exhausted = False
+        self.rest = None
+
+    def read(self):
+        r'''
+        Append the next chunk to the buffer.
+        Returns false if there is no more chunk.
+        '''
+        for chunk in self.chunks:
+            if chunk:
+                self.buf += chunk
+                return True
+        self.exhausted = True
+        return False
+
+    def find_array(self):
+        r'''
+        Returns the position just after the "[" which starts the array
+        at <self.path>, or None if there is no such array.
+        '''
+        stack = []  # [key, expect_key] for objects, None for arrays
+        i = 0
+        string_start = None
+        escape = False
+        while True:
+            if i >= len(self.buf) and not self.read():
+                return None
+            c = self.buf[i]
+            if string_start is not None:
+                if escape:
+                    escape = False
+                elif c == '\\':
+                    escape = True
+                elif c == '"':
+                    if stack and stack[-1] is not None and stack[-1][1]:
+                        stack[-1][0] = json.loads(self.buf[string_start:i + 1])
+                    string_start = None
+            elif c == '"':
+                string_start = i
+            elif c == '{':
+                stack.append([None, True])
+            elif c == '[':
+                if (stack and None not in stack and
+                        map(lambda e: e[0], stack) == self.path):
+                    return i + 1
+                stack.append(None)
+            elif c in '}]':
+                stack.pop()
+            elif c == ':':
+                stack[-1][1] = False
+            elif c == ',' and stack and stack[-1] is not None:
+                stack[-1][1] = True
+            i += 1
+
+    def skip(self, pos, chars):
+        while True:
+            while pos < len(self.buf) and self.buf[pos] in chars:
+                pos += 1
+            if pos < len(self.buf) or not self.read():
+                return pos
+
+    def __iter__(self):
+        start = self.find_array()
+        if start is None:
+            self.rest = loads(self.buf)
+            raise ArrayNotFoundError(self.path, self.rest)
+        prefix = self.buf[:start]
+        self.buf = self.buf[start:]
+        pos = 0
+        while True:
+            pos = self.skip(pos, JSON_WHITESPACE + ',')
+            if pos >= len(self.buf):
+                raise ValueError('Unexpected end of JSON data')
+            if self.buf[pos] == ']':
+                break
+            try:
+                item, end = self.decoder.raw_decode(self.buf, pos)
+                # a number may be cut by the end of the chunk
+                complete = self.exhausted or (
+                    end < len(self.buf) and
+                    self.buf[end] in JSON_WHITESPACE + ',]')
+            except ValueError:
+                if self.exhausted:
+                    raise
+                complete = False
+            if not complete:
+                self.read()
+                continue
+            self.buf = self.buf[end:]
+            pos = 0
+            yield item
+        while self.read():
+            pass
+        self.rest = loads(prefix + self.buf[pos:])
@@ -1,37 +1,408 @@
 import esjson
+import random
 import requests
+import threading
 import time
+import Queue
+from email.utils import parsedate_tz, mktime_tz
+from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
+
+DEFAULT_POOL_SIZE = 10
+# seconds of a request, None waits as long as it takes (e.g. a bulk)
+DEFAULT_TIMEOUT = None
+# retry policy
+MAX_INTERVAL = 30
+RETRY_STATUS = (429, 503)
+# circuit breaker
+BREAKER_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+
+
+class CircuitOpenError(Exception):
+    '''
+    Raised without sending the request while the host is considered down.
+    '''
+    pass
+
+
+class SessionPool(object):
+    '''
+    A thread-safe pool of persistent sessions to one host.
+    At most <size> sessions are created. Each session keeps its
+    connection alive between requests.
+    '''
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.size = size
+        self.sessions = Queue.LifoQueue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.sessions.get_nowait()
+        except Queue.Empty:
+            pass
+        with self.lock:
+            if self.created < self.size:
+                self.created += 1
+                return requests.Session()
+        return self.sessions.get()
+
+    def release(self, session):
+        self.sessions.put(session)
+
+    def close(self):
+        while True:
+            try:
+                self.sessions.get_nowait().close()
+            except Queue.Empty:
+                break
+
+
+class CircuitBreaker(object):
+    '''
+    Opens after <threshold> consecutive failures. While it is open,
+    requests fail fast with CircuitOpenError. After <reset_timeout>
+    seconds one request is let through: the circuit is closed if
+    it succeeds and opened again if it fails.
+    '''
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT, clock=time.time):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def check(self, host):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if (self.probing or
+                    self.clock() - self.opened_at < self.reset_timeout):
+                raise CircuitOpenError('%s is down' % host)
+            self.probing = True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                self.opened_at = self.clock()
+            self.probing = False
+
+    def cancel(self):
+        '''
+        The request did not get an answer for another reason:
+        the next one may probe the host.
+        '''
+        with self.lock:
+            self.probing = False
+
+
+# host => SessionPool
+__global_pools = {}
+__global_pools_lock = threading.Lock()
+__global_pool_size = DEFAULT_POOL_SIZE
+
+
+def host_of(url):
+    u = urlparse(url)
+    return '%s://%s' % (u.scheme, u.netloc)
+
+
+def get_pool(url):
+    host = host_of(url)
+    with __global_pools_lock:
+        try:
+            return __global_pools[host]
+        except KeyError:
+            pool = SessionPool(__global_pool_size)
+            __global_pools[host] = pool
+            return pool
+
+
+# host => CircuitBreaker
+__global_breakers = {}
+
+
+def get_breaker(url):
+    host = host_of(url)
+    with __global_pools_lock:
+        try:
+            return __global_breakers[host]
+        except KeyError:
+            breaker = CircuitBreaker()
+            __global_breakers[host] = breaker
+            return breaker
+
+
+def set_pool_size(size):
+    '''
+    Set the max number of sessions per host.
+    The existing pools are closed.
+    '''
+    global __global_pool_size
+    with __global_pools_lock:
+        __global_pool_size = size
+        for pool in __global_pools.values():
+            pool.close()
+        __global_pools.clear()
+
+
+class StreamRelease(object):
+    '''
+    Releases <session> to <pool> when the content of the streamed response
+    <res> is read (or its iteration is abandoned) or <res> is closed,
+    so the connection is not used by another thread in the meantime.
+    '''
+    def __init__(self, res, pool, session):
+        self.pool = pool
+        self.session = session
+        self.lock = threading.Lock()
+        self.iter_content = res.iter_content
+        self.close = res.close
+        res.iter_content = self.iter_and_release
+        res.close = self.close_and_release
+
+    def release(self):
+        with self.lock:
+            session, self.session = self.session, None
+        if session is not None:
+            self.pool.release(session)
+
+    def iter_and_release(self, *args, **kwargs):
+        try:
+            for chunk in self.iter_content(*args, **kwargs):
+                yield chunk
+        finally:
+            self.close_and_release()
+
+    def close_and_release(self):
+        try:
+            self.close()
+        finally:
+            self.release()
+
+
+def pooled(method_name):
+    '''
+    Returns a function which does the request <method_name>
+    with a session from the pool of the host.
+    The session of a streamed request is released when its response
+    is read or closed.
+    '''
+    def request(url, *args, **kwargs):
+        breaker = get_breaker(url)
+        breaker.check(host_of(url))
+        pool = get_pool(url)
+        session = pool.acquire()
+        try:
+            res = getattr(session, method_name)(url, *args, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            pool.release(session)
+            breaker.failure()
+            raise
+        except BaseException:
+            pool.release(session)
+            breaker.cancel()
+            raise
+        if kwargs.get('stream'):
+            StreamRelease(res, pool, session)
+        else:
+            pool.release(session)
+        if res.status_code == 503:
+            breaker.failure()
+        else:
+            breaker.success()
+        return res
+    return request
+
+
+pooled_post = pooled('post')
+pooled_get = pooled('get')
+
+
+def routed(nodes, method):
+    '''
+    Returns a function which takes a path (e.g. "/index/_search") instead of
+    a url and does the request <method> to the best node of <nodes>,
+    a NodeSet. The latency and the failures are reported to <nodes>.
+    A node which is unreachable is marked dead and the next one is tried.
+    '''
+    def request(path, *args, **kwargs):
+        tried = []
+        while True:
+            host = nodes.best(tried)
+            tried.append(host)
+            start = time.time()
+            try:
+                res = method(host + path, *args, **kwargs)
+            except (requests.ConnectionError, CircuitOpenError):
+                nodes.report(host, time.time() - start, False)
+                nodes.mark_dead(host)
+                if len(tried) >= len(nodes.hosts):
+                    raise
+                continue
+            except requests.Timeout:
+                # slow but alive: the retry may try it again
+                nodes.report(host, time.time() - start, False)
+                raise
+            nodes.report(host, time.time() - start, res.status_code < 500)
+            return res
+    return request
 
 
 def try_request(retries, interval, method, *args, **kwargs):
     '''
     "method" is the function to do real request.
     '''
+    return try_request_response(
+        retries, interval, method, *args, **kwargs).text
+
+
+def try_request_response(retries, interval, method, *args, **kwargs):
+    '''
+    The same as try_request but returns the response object.
+    Retries on connection errors, timeouts and on the status in
+    RETRY_STATUS, at most <retries> attempts in all. The n-th retry waits
+    a random time up to min(MAX_INTERVAL, interval * 2 ** n), or the
+    Retry-After of the response if it is longer, but never more than
+    MAX_INTERVAL.
+    If "deadline" (in seconds) is in <kwargs>, no retry starts after it
+    and the wait is cut to it.
+    '''
+    deadline = kwargs.pop('deadline', None)
+    if deadline is not None:
+        deadline += time.time()
     i = 0
-    res = None
-    while not res and i < retries:
+    while True:
+        error = None
         try:
             res = method(*args, **kwargs)
-        except requests.ConnectionError, e:
-            i += 1
-            if i >= retries:
-                raise e
-            time.sleep(interval)
-    return res.text
+        except (requests.ConnectionError, requests.Timeout), e:
+            error = e
+            res = None
+        i += 1
+        if res is not None and res.status_code not in RETRY_STATUS:
+            return res
+        delay = backoff(interval, i)
+        if res is not None:
+            delay = min(max(delay, retry_after(res)), MAX_INTERVAL)
+        if deadline is not None:
+            delay = min(delay, deadline - time.time())
+        if i >= retries or delay < 0:
+            if error is not None:
+                raise error
+            return res
+        if res is not None:
+            # releases the connection of a streamed response
+            res.close()
+        time.sleep(delay)
+
+
+def backoff(interval, n):
+    '''
+    Exponential backoff with full jitter.
+    '''
+    return random.uniform(0, min(MAX_INTERVAL, interval * 2 ** (n - 1)))
+
+
+def retry_after(res):
+    '''
+    Returns the seconds to wait in the Retry-After header of <res>
+    (either seconds or a HTTP-date), or 0 if there is none.
+    '''
+    value = res.headers.get('Retry-After')
+    if value is None:
+        return 0
+    try:
+        return max(0, int(value))
+    except ValueError:
+        date = parsedate_tz(value)
+        if date is None:
+            return 0
+        return max(0, mktime_tz(date) - time.time())
+
 
+def request_method(method, nodes):
+    if nodes is None:
+        return method
+    return routed(nodes, method)
 
-def espost(url, data, retries=3, interval=1):
+
+# If <nodes> (a NodeSet) is given, <url> is the path of the url and
+# the request is sent to the best node.
+
+
+def espost(url, data, retries=3, interval=1, timeout=DEFAULT_TIMEOUT,
+           deadline=None, nodes=None):
     headers = {'content-type': 'application/json'}
     data_str = esjson.dumps(data)
     return try_request(
         retries, interval,
-        requests.post, url, data_str, headers=headers
+        request_method(pooled_post, nodes), url, data_str,
+        headers=headers, timeout=timeout, deadline=deadline
     )
 
 
-def esget(url, retries=3, interval=1):
+def esget(url, retries=3, interval=1, timeout=DEFAULT_TIMEOUT,
+          deadline=None, nodes=None):
     headers = {'content-type': 'application/json'}
     return try_request(
         retries, interval,
-        requests.get, url, headers=headers
+        request_method(pooled_get, nodes), url,
+        headers=headers, timeout=timeout, deadline=deadline
     )
+
+
+def espost_stream(url, data, retries=3, interval=1, chunk_size=65536,
+                  timeout=DEFAULT_TIMEOUT, deadline=None, nodes=None):
+    '''
+    Returns the content of the response as an iterator of chunks
+    which are read from the socket only when they are needed.
+    Raises requests.HTTPError (with the error of elasticsearch in its
+    message) if the status is not 2xx.
+    '''
+    headers = {'content-type': 'application/json'}
+    data_str = esjson.dumps(data)
+    res = try_request_response(
+        retries, interval,
+        request_method(pooled_post, nodes), url, data_str,
+        headers=headers, stream=True, timeout=timeout, deadline=deadline
+    )
+    if not 200 <= res.status_code < 300:
+        # the body of an error is small, reading it releases the connection
+        raise requests.HTTPError(
+            '%s %s: %s' % (res.status_code, res.reason, res.text),
+            response=res)
+    return res.iter_content(chunk_size)
+
+
+def espost_batch(url_data_list, workers=None, **kwargs):
+    '''
+    Post all the (url, data) in <url_data_list> concurrently and
+    returns the responses in the same order.
+    <workers> is the number of concurrent requests,
+    which is the pool size by default.
+    <kwargs> are passed to espost.
+    '''
+    if workers is None:
+        workers = __global_pool_size
+    workers = max(1, min(workers, len(url_data_list)))
+    thread_pool = ThreadPool(workers)
+    try:
+        return thread_pool.map(
+            lambda (url, data): espost(url, data, **kwargs),
+            url_data_list)
+    finally:
+        thread_pool.close()
+        thread_pool.join()
@@ -0,0 +1,81 @@
+import time
+import threading
+
+# weight of the newest sample in the moving averages
+DEFAULT_ALPHA = 0.3
+# a node which always fails scores (1 + ERROR_PENALTY) times its latency
+ERROR_PENALTY = 10
+# seconds a failed node is left alone
+DEFAULT_COOLDOWN = 30
+
+
+class NodeStats(object):
+    '''
+    Exponentially weighted moving averages of the latency
+    and the error rate of one node.
+    '''
+    def __init__(self, alpha=DEFAULT_ALPHA):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.lock = threading.Lock()
+
+    def report(self, latency, ok):
+        a = self.alpha
+        with self.lock:
+            if ok:
+                if self.latency is None:
+                    self.latency = latency
+                else:
+                    self.latency = a * latency + (1 - a) * self.latency
+            self.error_rate = a * (0 if ok else 1) + (1 - a) * self.error_rate
+
+    def score(self):
+        '''
+        The lower the better.
+        A node which has never answered scores 0 so that it is tried first.
+        '''
+        if self.latency is None:
+            return 0.
+        return self.latency * (1 + ERROR_PENALTY * self.error_rate)
+
+
+class NodeSet(object):
+    '''
+    A set of nodes (e.g. "http://host:9200") of one cluster.
+    best() returns the live node with the best score. A node marked dead
+    is skipped for <cooldown> seconds unless all the nodes are dead.
+    '''
+    def __init__(self, hosts, cooldown=DEFAULT_COOLDOWN, clock=time.time):
+        self.hosts = list(hosts)
+        self.stats = dict(map(lambda h: (h, NodeStats()), self.hosts))
+        self.dead_until = {}
+        self.cooldown = cooldown
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def alive(self):
+        now = self.clock()
+        with self.lock:
+            return filter(lambda h: self.dead_until.get(h, 0) <= now,
+                          self.hosts)
+
+    def best(self, exclude=()):
+        hosts = filter(lambda h: h not in exclude, self.alive())
+        if len(hosts) == 0:
+            # every node is dead: try the one which will recover first
+            hosts = filter(lambda h: h not in exclude, self.hosts)
+            if len(hosts) == 0:
+                return None
+            return min(hosts, key=lambda h: self.dead_until.get(h, 0))
+        return min(hosts, key=lambda h: self.stats[h].score())
+
+    def report(self, host, latency, ok):
+        self.stats[host].report(latency, ok)
+        if ok:
+            with self.lock:
+                self.dead_until.pop(host, None)
+
+    def mark_dead(self, host):
+        with self.lock:
+            self.dead_until[host] = self.clock() + self.cooldown
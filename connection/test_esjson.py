@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# The selection of the JSON backends and the encoding of esjson.
+
+import sys
+import json
+import types
+from datetime import datetime, timedelta, tzinfo
+from StringIO import StringIO
+
+import esjson
+
+
+def reload_with(modules):
+    r'''
+    Reload esjson with the modules in <modules> (name => module, or None
+    to make its import fail) and returns (encoder_name, decoder_name).
+    '''
+    saved = dict((name, sys.modules.get(name)) for name in modules)
+    sys.modules.update(modules)
+    try:
+        reload(esjson)
+        return esjson.encoder_name, esjson.decoder_name
+    finally:
+        for name, module in saved.items():
+            if module is None:
+                sys.modules.pop(name, None)
+            else:
+                sys.modules[name] = module
+        reload(esjson)
+
+
+def fake_module(name, **functions):
+    module = types.ModuleType(name)
+    module.__dict__.update(functions)
+    return module
+
+
+fake_simplejson = fake_module(
+    'simplejson', JSONEncoder=json.JSONEncoder, JSONDecoder=json.JSONDecoder,
+    loads=json.loads)
+fake_ujson = fake_module('ujson', loads=json.loads)
+
+print 'installed:', esjson.encoder_name, esjson.decoder_name
+print 'fallback:', reload_with({'simplejson': None, 'ujson': None})
+print 'simplejson:', reload_with({'simplejson': fake_simplejson,
+                                  'ujson': None})
+print 'both:', reload_with({'simplejson': fake_simplejson,
+                            'ujson': fake_ujson})
+
+
+class GMTn8(tzinfo):
+    def utcoffset(self, dt):
+        return timedelta(hours=8)
+
+    def dst(self, dt):
+        return timedelta(0)
+
+
+t = datetime(2015, 3, 1, 12, 30, tzinfo=GMTn8())
+print esjson.dumps({'b': [t], 'a': 1}, sort_keys=True)
+
+data = '{"hits": {"total": 2, "hits": [{"_source": {"i": 0}}, {"i": 1}]}}'
+print esjson.loads(data) == json.loads(data)
+print esjson.loads(StringIO(data)) == json.loads(data)
+
+stream = esjson.ArrayStream(iter([data[:10], data[10:30], data[30:]]),
+                            ['hits', 'hits'])
+print list(stream), stream.rest
+try:
+    list(esjson.ArrayStream([data], ['hits', 'nothing']))
+except esjson.ArrayNotFoundError as e:
+    print 'not found:', e.path
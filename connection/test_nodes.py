@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Route requests over several local stand-in nodes, with espost and
+# with the client of tieslib (connect!), and open the circuit of a node
+# which times out.
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+
+from espost import (espost, pooled_post, get_breaker, set_pool_size,
+                    BREAKER_THRESHOLD, DEFAULT_POOL_SIZE)
+from nodes import NodeSet
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        self.server.count += 1
+        time.sleep(self.server.delay)
+        out = json.dumps({'port': self.server.server_port})
+        self.send_response(200)
+        self.send_header('content-length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    # elasticsearch-py sends the body of a search with GET
+    do_GET = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # a client which timed out has closed the connection
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(
+                self, request, client_address)
+
+
+def start_node(delay):
+    server = Server(('127.0.0.1', 0), Handler)
+    server.delay = delay
+    server.count = 0
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    server.thread = t
+    return server
+
+
+def stop_node(server):
+    server.shutdown()
+    server.server_close()
+    server.thread.join()
+
+
+def unused_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+fast = start_node(0.001)
+slow = start_node(0.05)
+dead_port = unused_port()
+
+hosts = [
+    'http://127.0.0.1:%s' % dead_port,
+    'http://127.0.0.1:%s' % slow.server_port,
+    'http://127.0.0.1:%s' % fast.server_port,
+]
+nodes = NodeSet(hosts)
+
+for i in xrange(50):
+    espost('/index/_search', {}, interval=0.01, nodes=nodes)
+
+print 'fast node:', fast.count
+print 'slow node:', slow.count
+print 'dead node alive:', hosts[0] in nodes.alive()
+print 'best:', nodes.best() == hosts[2]
+
+# the package of tieslib is in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+from tieslib.tieslib import setup_ties_environment, es_clients_clear
+from interp.tilib import dostring
+
+fast.count = slow.count = 0
+env = setup_ties_environment()
+dostring('(cache-off)', env)
+dostring('(connect! (list "127.0.0.1:%s" "127.0.0.1:%s" "127.0.0.1:%s"))'
+         % (dead_port, slow.server_port, fast.server_port), env)
+ports = map(
+    lambda i: dostring('(origin-search (translate-hits 1))', env)['port'],
+    xrange(50))
+print 'connect! fast node:', fast.count, ports.count(fast.server_port)
+print 'connect! slow node:', slow.count
+print 'connect! last node:', ports[-1] == fast.server_port
+es_clients_clear()
+
+
+def post_status(url, **kwargs):
+    try:
+        return pooled_post(url, '{}', **kwargs).status_code
+    except Exception as e:
+        return type(e).__name__
+
+
+# the breaker of a node, with a fake clock
+timing_out = start_node(0.2)
+url = 'http://127.0.0.1:%s/index/_search' % timing_out.server_port
+now = [0]
+breaker = get_breaker(url)
+breaker.clock = lambda: now[0]
+print 'timeouts:', [post_status(url, timeout=0.05)
+                    for i in xrange(BREAKER_THRESHOLD)]
+print 'open:', post_status(url, timeout=0.05)
+now[0] += breaker.reset_timeout
+print 'timed out probe:', post_status(url, timeout=0.05)
+print 'open again:', post_status(url, timeout=0.05)
+now[0] += breaker.reset_timeout
+print 'failed probe:', post_status(url, bogus=True)
+timing_out.delay = 0
+print 'probe:', post_status(url, timeout=0.05)
+print 'closed:', post_status(url, timeout=0.05)
+
+# closes the kept-alive connections, then the servers
+set_pool_size(DEFAULT_POOL_SIZE)
+stop_node(fast)
+stop_node(slow)
+stop_node(timing_out)
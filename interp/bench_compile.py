@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# Compare the compiler (ticompile) with the analyzer.
+
+import time
+
+from tilib import setup_environment, dostring, set_compile_mode, tostring
+
+
+ARITHMETIC = '''
+(define (fib n)
+  (if (< n 2)
+      n
+      (+ (fib (- n 1)) (fib (- n 2)))))
+(define (sum-to n acc)
+  (if (= n 0)
+      acc
+      (sum-to (- n 1) (+ acc (* n n)))))
+(+ (fib 16) (sum-to 20000 0))
+'''
+
+LISTS = '''
+(define (range n acc)
+  (if (= n 0)
+      acc
+      (range (- n 1) (cons n acc))))
+(define (length seq n)
+  (if (null? seq)
+      n
+      (length (cdr seq) (+ n 1))))
+(define (sum seq acc)
+  (if (null? seq)
+      acc
+      (sum (cdr seq) (+ acc (car seq)))))
+(define xs (range 500 nil))
+(define (run k acc)
+  (if (= k 0)
+      acc
+      (run (- k 1)
+           (+ acc (length xs 0)
+                  (sum (map (lambda (x) (* x 2)) xs) 0)))))
+(run 10 0)
+'''
+
+# the applications of known primitives nested 30 levels deep
+NESTED = '''
+(define (f x) %s)
+(define (loop n acc)
+  (if (= n 0)
+      acc
+      (loop (- n 1) (+ acc (f n)))))
+(loop 2000 0)
+''' % ('(+ 1 ' * 30 + 'x' + ')' * 30)
+
+
+def bench(src, compile_mode, repeat=3):
+    set_compile_mode(compile_mode)
+    best = None
+    for _ in xrange(repeat):
+        env = setup_environment()
+        start = time.time()
+        value = dostring(src, env)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    set_compile_mode(False)
+    return best, tostring(value)
+
+
+for name, src in [('arithmetic', ARITHMETIC), ('lists', LISTS),
+                  ('nested', NESTED)]:
+    analyzed, v1 = bench(src, False)
+    compiled, v2 = bench(src, True)
+    assert v1 == v2, (v1, v2)
+    print '%-12s analyzer: %.3fs  compiler: %.3fs  speedup: %.2fx' % (
+        name, analyzed, compiled, analyzed / compiled)
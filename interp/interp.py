@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 
 import sys
-import readline
 
 from tierror import TiError
 
@@ -104,6 +103,8 @@ def rlcompleter(get_env):
 
 
 def driver_loop(newenv, get_prompt):
+    # imported only by the interactive loop
+    import readline
     readline.parse_and_bind('tab: complete')
     readline.set_completer_delims('')
     interpreter = Interpreter(dostring, newenv)
@@ -5,6 +5,6 @@ tests = '''
 (dfe (welj) s12)
 '''.strip().split('\n')
 
-from tiparser import scanne
+from tiparser import scan
 for data in tests:
-    print scanne(data)
+    print scan(data)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+from tilib import setup_environment, dostring
+
+
+text = '''
+(define (range n)
+  (define (iter i res)
+    (if (= i 0)
+        res
+        (iter (- i 1) (cons i res))))
+  (iter n nil))
+(define (sum seq)
+  (define (iter seq res)
+    (if (null? seq)
+        res
+        (iter (cdr seq) (+ res (car seq)))))
+  (iter seq 0))
+(define big (range 100000))
+(display (sum big))
+(display (sum (cdr (list 1 2 3))))
+(display (list (list? big) (pair? big) (null? (cdr (cdr (list 1 2))))))
+(display (cons 0 (cdr (list 1 2 3))))
+(display (= (cons 1 (list 2)) (list 1 2)))
+(eqv? (cdr (cons 1 (list 2))) (cdr (list 1 2)))
+'''
+
+env = setup_environment()
+output = dostring(text, env)
+print
+print output
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+
+from tilib import setup_environment, dostring, start_profile, stop_profile
+
+
+text = '''
+(define (gcd a b)
+  (if (= a 0)
+      b
+      (gcd (% b a) a)))
+(profile (gcd 144 12144))
+'''
+
+env = setup_environment()
+output = dostring(text, env)
+print output
+
+# the cumulative time of a procedure includes its tail calls
+text = '''
+(define (count-down n)
+  (if (= n 0)
+      'done
+      (count-down (- n 1))))
+(define (run) (count-down 20000))
+'''
+dostring(text, env)
+profiler = start_profile()
+dostring('(run)', env)
+stop_profile()
+stats = dict(map(lambda r: (r[0], r), profiler.rows()))
+print 'calls:', stats['run'][1], stats['count-down'][1]
+print 'run includes count-down:', stats['run'][3] >= stats['count-down'][3]
+print 'stack unwound:', profiler.depth() == 0
@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+
+from tilib import setup_environment, dostring
+
+
+text = '''
+(define docs
+  (list (list "a.com" 1) (list "b.com" 2) (list "a.com" 3)))
+(define counts (make-table))
+(define (count-domains docs)
+  (if (null? docs)
+      counts
+      (begin
+        (table-update! counts (car (car docs)) (lambda (n) (+ n 1)) 0)
+        (count-domains (cdr docs)))))
+(count-domains docs)
+(table-set! counts 'c 0)
+(table-delete! counts "c")
+(list (table-ref counts "a.com")
+      (table-ref counts "x.com" 0)
+      (table-has-key? counts "b.com")
+      (table-count counts)
+      (table? counts)
+      (table? docs))
+'''
+
+env = setup_environment()
+output = dostring(text, env)
+print output
+print dostring('counts', env)
@@ -0,0 +1,16 @@
+#!/usr/bin/env python
+
+from tilib import setup_environment, dostring
+
+
+text = '''
+(define (count-down n)
+  (if (= n 0)
+      0
+      (count-down (- n 1))))
+(count-down 100000)
+'''
+
+env = setup_environment()
+output = dostring(text, env)
+print output
@@ -0,0 +1,165 @@
+r'''
+The on-disk cache of the parsed expressions of the loaded files.
+A file is parsed again only if its path, mtime or content changed.
+The expressions are written and read one by one, so the expressions
+of a whole file are never held in memory.
+'''
+
+import os
+import cPickle as pickle
+import hashlib
+import itertools
+
+from tiparser import iter_parse
+
+# increase it when the parsed expressions change
+CACHE_VERSION = 2
+
+# $TIES_CACHE_DIR is the directory of the cache, an empty one disables it
+DEFAULT_CACHE_DIR = os.environ.get(
+    'TIES_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.ties_cache'))
+
+
+class FormCache(object):
+    r'''
+    Each file has a pickle file in <directory>: its key, its expressions
+    (one pickle record each) and None, which is never an expression.
+    The errors of the cache are ignored: the file is parsed instead.
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, fn):
+        key = hashlib.sha1(os.path.abspath(fn)).hexdigest()
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, fn, mtime, digest):
+        r'''
+        Returns an iterator of the expressions of <fn> or None.
+        The iterator raises an exception if the entry is broken.
+        '''
+        try:
+            f = open(self.path(fn), 'rb')
+        except IOError:
+            return None
+        try:
+            key = pickle.load(f)
+        except Exception:
+            f.close()
+            return None
+        if key != self.key(fn, mtime, digest):
+            f.close()
+            return None
+        return self.load(f)
+
+    def load(self, f):
+        with f:
+            while True:
+                exp = pickle.load(f)
+                if exp is None:
+                    return
+                yield exp
+
+    def put(self, fn, mtime, digest, exps):
+        r'''
+        Yields the expressions of the iterable <exps> and writes them
+        one by one. The entry is saved only after the last one is read.
+        '''
+        path = self.path(fn)
+        tmp = '%s.%d.tmp' % (path, os.getpid())
+        f = None
+        try:
+            try:
+                if not os.path.isdir(self.directory):
+                    os.makedirs(self.directory)
+                f = open(tmp, 'wb')
+                pickle.dump(self.key(fn, mtime, digest), f,
+                            pickle.HIGHEST_PROTOCOL)
+            except (IOError, OSError):
+                f = None
+            for exp in exps:
+                if f is not None:
+                    try:
+                        pickle.dump(exp, f, pickle.HIGHEST_PROTOCOL)
+                    except (IOError, pickle.PicklingError, RuntimeError):
+                        f.close()
+                        f = None
+                yield exp
+            if f is not None:
+                try:
+                    pickle.dump(None, f, pickle.HIGHEST_PROTOCOL)
+                    f.close()
+                    f = None
+                    os.rename(tmp, path)
+                except (IOError, OSError):
+                    pass
+        finally:
+            if f is not None:
+                f.close()
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def key(self, fn, mtime, digest):
+        return (CACHE_VERSION, os.path.abspath(fn), mtime, digest)
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.directory, name))
+
+
+__global_form_cache = None
+
+
+def set_form_cache_dir(directory):
+    r'''
+    Use <directory> for the cache, or disable it if <directory> is None
+    or empty.
+    '''
+    global __global_form_cache
+    if not directory:
+        __global_form_cache = None
+    else:
+        __global_form_cache = FormCache(directory)
+
+
+set_form_cache_dir(DEFAULT_CACHE_DIR)
+
+
+def get_form_cache():
+    return __global_form_cache
+
+
+def iter_file(fn):
+    r'''
+    Yields the expressions in the file <fn> one by one.
+    '''
+    with open(fn) as f:
+        text = f.read()
+        mtime = os.fstat(f.fileno()).st_mtime
+    cache = __global_form_cache
+    if cache is None:
+        for exp in iter_parse(text):
+            yield exp
+        return
+    digest = hashlib.sha1(text).hexdigest()
+    exps = cache.get(fn, mtime, digest)
+    if exps is None:
+        for exp in cache.put(fn, mtime, digest, iter_parse(text)):
+            yield exp
+        return
+    count = 0
+    while True:
+        try:
+            exp = next(exps)
+        except StopIteration:
+            return
+        except Exception:
+            # a broken entry: the rest of the file is parsed
+            break
+        count += 1
+        yield exp
+    for exp in itertools.islice(iter_parse(text), count, None):
+        yield exp
@@ -0,0 +1,258 @@
+r'''
+Compile Ti expressions to Python source.
+
+Each procedure body becomes a Python function of a Frame, like the
+closures made by tilib.analyze, so the compiled procedures are applied,
+profiled and tail called by tilib in the same way.
+The source of a sequence of expressions is compiled once by Python.
+'''
+
+from titype import (
+    mkvoid,
+    istrue,
+    issymbol, symbol_tostring,
+    mkcompound,
+    islist, ispair,
+)
+
+from tikeyword import KW
+from tilib import (
+    check_error, raise_error,
+    procedure_scope,
+    is_self_evaluating, is_variable, is_lambda,
+    special_forms,
+    analyze_seq,
+    checked_value, global_lookup,
+    env_put, frame_put,
+    load_file, require_file, run_profiled,
+    TailCall, _apply,
+    known_primitive, check_primitive_argc, redefine,
+    call_known_primitive, call_known_primitive0, call_known_primitive1,
+    call_known_primitive2, call_known_primitive3,
+    fold_constant, report_folding, primitives_version, lazy_call,
+)
+
+
+# the names which the generated source refers to
+RUNTIME = {
+    '_istrue': istrue,
+    '_mkcompound': mkcompound,
+    '_checked': checked_value,
+    '_global': global_lookup,
+    '_env_put': env_put,
+    '_frame_put': frame_put,
+    '_load_file': load_file,
+    '_require_file': require_file,
+    '_run_profiled': run_profiled,
+    '_TailCall': TailCall,
+    '_apply': _apply,
+    '_call_known': call_known_primitive,
+    '_call_known0': call_known_primitive0,
+    '_call_known1': call_known_primitive1,
+    '_call_known2': call_known_primitive2,
+    '_call_known3': call_known_primitive3,
+    '_primitives_version': primitives_version,
+}
+
+
+class Compiler(object):
+    r'''
+    Generates the source of a Python module.
+    The constants (quoted data, scopes, ...) are passed to the module
+    as global variables.
+    '''
+    def __init__(self):
+        self.functions = []
+        self.constants = {}
+        self.count = 0
+
+    def new_name(self, prefix):
+        self.count += 1
+        return '%s%d' % (prefix, self.count)
+
+    def constant(self, value):
+        name = self.new_name('_k')
+        self.constants[name] = value
+        return name
+
+    def function(self, expr):
+        r'''
+        Returns the name of a new function of env which returns <expr>.
+        '''
+        name = self.new_name('_f')
+        self.functions.append('def %s(env):\n    return %s\n' % (name, expr))
+        return name
+
+    def source(self):
+        return '\n'.join(self.functions)
+
+    def build(self):
+        r'''
+        Returns the namespace of the compiled module.
+        '''
+        code = compile(self.source(), '<ticompile>', 'exec')
+        namespace = dict(RUNTIME)
+        namespace.update(self.constants)
+        exec code in namespace
+        return namespace
+
+    # The compile_* methods return a Python expression of env.
+
+    def compile(self, exp, scope=None, tail=False):
+        if is_self_evaluating(exp):
+            return self.constant(exp)
+        elif is_variable(exp):
+            return self.compile_variable(exp, scope)
+        elif ispair(exp):
+            head = exp[0]
+            if issymbol(head):
+                method = SPECIAL_FORMS.get(head)
+                if method is not None:
+                    return method(self, exp, scope, tail)
+            return self.compile_application(exp, scope, tail)
+        else:
+            raise_error('unknown exp type -- ANALYZE: %s' % exp)
+
+    def compile_quote(self, exp, scope, tail):
+        assert len(exp) == 2, str(exp)
+        return self.constant(exp[1])
+
+    def compile_begin(self, exp, scope, tail):
+        return self.compile_seq(exp[1:], scope, tail)
+
+    def compile_load(self, exp, scope, tail):
+        check_error(len(exp) == 2)
+        return '_load_file(env, %s)' % self.compile(exp[1], scope)
+
+    def compile_require(self, exp, scope, tail):
+        check_error(len(exp) == 2)
+        return '_require_file(env, %s)' % self.compile(exp[1], scope)
+
+    def compile_cond(self, exp, scope, tail):
+        check_error(False)  # TODO
+
+    def compile_lambda(self, exp, scope, tail):
+        check_error(len(exp) >= 3)
+        return self.compile_procedure(exp[1], exp[2:], scope)
+
+    def compile_profile(self, exp, scope, tail):
+        check_error(len(exp) == 2)
+        thunk = self.function(self.compile(exp[1], scope))
+        return '_run_profiled(%s, env)' % thunk
+
+    def compile_variable(self, exp, scope):
+        name = symbol_tostring(exp)
+        address = None
+        if scope is not None:
+            address = scope.resolve(name)
+        if address is None:
+            return '_global(env, %r)' % name
+        depth, slot, var_scope = address
+        lookup = 'env%s.values[%d]' % ('.enclosing' * depth, slot)
+        if slot < var_scope.nargs:
+            return lookup
+        return '_checked(%s, %r)' % (lookup, name)
+
+    def compile_define(self, exp, scope, tail=False):
+        check_error(len(exp) >= 3)
+        subexp = exp[1]
+        if islist(subexp):
+            check_error(len(subexp) > 0 and issymbol(subexp[0]))
+            name = symbol_tostring(subexp[0])
+            value = self.compile_procedure(subexp[1:], exp[2:], scope, name)
+        else:
+            check_error(len(exp) == 3)
+            check_error(issymbol(subexp))
+            name = symbol_tostring(subexp)
+            if is_lambda(exp[2]):
+                check_error(len(exp[2]) >= 3)
+                value = self.compile_procedure(
+                    exp[2][1], exp[2][2:], scope, name)
+            else:
+                value = self.compile(exp[2], scope)
+        if scope is None:
+            redefine(name)
+            return '_env_put(env, %r, %s)' % (name, value)
+        scope.add(name)
+        return '_frame_put(env, %d, %s)' % (scope.index[name], value)
+
+    def compile_procedure(self, args, exps, scope, name=None):
+        args, proc_scope = procedure_scope(args, exps, scope)
+        body = self.function(self.compile_seq(exps, proc_scope, True))
+        return '_mkcompound(%s, %s, env, %s, %s)' % (
+            self.constant(args), body,
+            self.constant(name), self.constant(proc_scope))
+
+    def compile_if(self, exp, scope, tail=False):
+        check_error(len(exp) == 4)
+        return '(%s if _istrue(%s) else %s)' % (
+            self.compile(exp[2], scope, tail),
+            self.compile(exp[1], scope),
+            self.compile(exp[3], scope, tail))
+
+    def compile_application(self, exp, scope, tail):
+        is_constant, value = fold_constant(exp, scope)
+        if not is_constant:
+            return self.compile_call(exp, scope, tail)
+        report_folding(exp, value)
+        # after a known primitive is redefined,
+        # the application is analyzed and evaluated by tilib
+        return '(%s if _primitives_version() == %d else %s(env))' % (
+            self.constant(value), primitives_version(),
+            self.constant(lazy_call(exp, scope, tail)))
+
+    def compile_call(self, exp, scope, tail):
+        proc = self.compile(exp[0], scope)
+        args = map(lambda e: self.compile(e, scope), exp[1:])
+        primitive = known_primitive(exp[0], scope)
+        if primitive is None:
+            return '%s(%s, [%s])' % (
+                '_TailCall' if tail else '_apply', proc, ', '.join(args))
+        check_primitive_argc(primitive, len(args))
+        # each argument is compiled once, so the source grows linearly
+        # with the nesting of the applications
+        if len(args) > 3:
+            return '_call_known(%s, %s, [%s], %s)' % (
+                proc, self.constant(primitive), ', '.join(args), tail)
+        return '_call_known%d(%s)' % (len(args), ', '.join(
+            [proc, self.constant(primitive)] + args + [str(tail)]))
+
+    def compile_seq(self, exps, scope=None, tail=False):
+        if len(exps) == 0:
+            return self.constant(mkvoid())
+        exprs = map(lambda e: self.compile(e, scope), exps[:-1])
+        exprs.append(self.compile(exps[-1], scope, tail))
+        if len(exprs) == 1:
+            return exprs[0]
+        # the elements of a tuple are evaluated from left to right
+        return '(%s)[-1]' % ', '.join(exprs)
+
+
+# keyword symbol => method of Compiler
+SPECIAL_FORMS = special_forms({
+    KW.QUOTE: Compiler.compile_quote,
+    KW.DEFINE: Compiler.compile_define,
+    KW.BEGIN: Compiler.compile_begin,
+    KW.LOAD: Compiler.compile_load,
+    KW.REQUIRE: Compiler.compile_require,
+    KW.IF: Compiler.compile_if,
+    KW.COND: Compiler.compile_cond,
+    KW.LAMBDA: Compiler.compile_lambda,
+    KW.PROFILE: Compiler.compile_profile,
+})
+
+
+def compile_seq(exps):
+    r'''
+    Returns a function of env which evaluates <exps>,
+    the same as tilib.analyze_seq(exps).
+    '''
+    compiler = Compiler()
+    try:
+        main = compiler.function(compiler.compile_seq(exps))
+        namespace = compiler.build()
+    except (SyntaxError, MemoryError, RuntimeError):
+        # too deeply nested for the Python parser or compiler
+        # (RuntimeError: maximum recursion depth exceeded)
+        return analyze_seq(exps)
+    return namespace[main]
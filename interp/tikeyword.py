@@ -6,10 +6,12 @@ KW = enum(
     'define',
     'begin',
     'load',
+    'require',
     'if',
     'cond',
     'lambda',
     'quote',
+    'profile',
     #'and',  TODO
     #'or',
     key_mapper=lambda s: s.upper())
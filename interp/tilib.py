@@ -1,5 +1,6 @@
 ##
 
+import os
 import sys
 
 from simpletable import SimpleTable
@@ -13,16 +14,19 @@ from titype import (
     mkfalse, idfalse,
     isnumber,
     isstring,
-    issymbol, symbol_tostring,
-    mkprimitive, isprimitive,
-    mkcompound, iscompound,
-    mklist, islist, ispair, list_tostring,
+    mksymbol, issymbol, symbol_tostring,
+    mkprimitive, isprimitive, Primitive,
+    mkcompound, iscompound, Compound,
+    mklist, islist, isseq, ispair, list_tostring,
     list_append, list_cons, list_car, list_cdr,
-    istable, table_tostring,
+    mktable, istable, ismutable_table, table_tostring,
+    table_haskey, table_ref, table_set, table_delete,
+    table_keys, table_values, table_items, table_count,
 )
 
 from tikeyword import KW
 from tierror import TiError
+from tiprofile import Profiler
 
 
 def keywords():
@@ -48,10 +52,14 @@ def raise_error(msg):
 class Env(object):
     r'''
     Symbol => TiValue
+    Used as the global environment.
     '''
     def __init__(self, enclosing_env=None):
         self.current_env = {}
         self.enclosing_env = enclosing_env
+        self.globals = self
+        # the real paths of the loaded files
+        self.loaded = set()
 
     def put(self, symbol, value):
         self.current_env[symbol] = value
@@ -90,23 +98,113 @@ class Env(object):
         return s
 
 
+class Frame(object):
+    r'''
+    The environment of a call of a compound procedure.
+    The values are stored in the slots given by the Scope of the procedure,
+    variables are addressed by (depth, slot) at analysis time.
+    <globals> is the global environment (an Env).
+    '''
+    __slots__ = ('values', 'enclosing', 'globals')
+
+    def __init__(self, values, enclosing):
+        self.values = values
+        self.enclosing = enclosing
+        self.globals = enclosing.globals
+
+
+class Unassigned(object):
+    r'''
+    The value of an internal definition before it is evaluated.
+    '''
+    pass
+
+
+UNASSIGNED = Unassigned()
+
+
+class Scope(object):
+    r'''
+    The names of the slots of the frames of a compound procedure,
+    known at analysis time: the arguments then the internal definitions.
+    The global scope is None.
+    '''
+    def __init__(self, names, enclosing=None):
+        self.names = []
+        self.index = {}
+        self.nargs = len(names)
+        self.enclosing = enclosing
+        for name in names:
+            self.add(name)
+
+    def add(self, name):
+        if name not in self.index:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+
+    def size(self):
+        return len(self.names)
+
+    def resolve(self, name):
+        r'''
+        Returns (depth, slot, scope) of <name> or None if it is global.
+        '''
+        depth = 0
+        scope = self
+        while scope is not None:
+            try:
+                return depth, scope.index[name], scope
+            except KeyError:
+                scope = scope.enclosing
+                depth += 1
+        return None
+
+
+def scan_defines(exps):
+    r'''
+    Returns the names defined by <exps> (and the begins in <exps>).
+    '''
+    names = []
+    for exp in exps:
+        if is_definition(exp) and len(exp) >= 2:
+            subexp = exp[1]
+            if islist(subexp) and len(subexp) > 0 and issymbol(subexp[0]):
+                names.append(symbol_tostring(subexp[0]))
+            elif issymbol(subexp):
+                names.append(symbol_tostring(subexp))
+        elif is_begin(exp):
+            names.extend(scan_defines(exp[1:]))
+    return names
+
+
 #######################################################################
 
 
-def make_procedure(args, exps):
+def procedure_scope(args, exps, scope):
+    r'''
+    Returns (names of <args>, the Scope of the body <exps>).
+    '''
     check_error(islist(args) and all(map(issymbol, args)))
     check_error(len(exps) > 0)
+    args = map(symbol_tostring, args)
+    proc_scope = Scope(args, scope)
+    for define_name in scan_defines(exps):
+        proc_scope.add(define_name)
+    return args, proc_scope
+
+
+def make_procedure(args, exps, scope, name=None):
+    args, proc_scope = procedure_scope(args, exps, scope)
     if len(exps) == 1:
-        proc = analyze(exps[0])
+        proc = analyze(exps[0], proc_scope, True)
     else:
-        proc = analyze_seq(exps)
-    args = map(symbol_tostring, args)
-    return lambda env: mkcompound(args, proc, env)
+        proc = analyze_seq(exps, proc_scope, True)
+    return lambda env: mkcompound(args, proc, env, name, proc_scope)
 
 
 def is_tagged_list(exp, tag):
     if islist(exp) and len(exp) > 0:
-        return issymbol(exp[0]) and exp[0] == tag
+        return issymbol(exp[0]) and exp[0] is mksymbol(tag)
     else:
         return False
 
@@ -124,11 +222,60 @@ def is_variable(exp):
     return issymbol(exp)
 
 
+def analyze_variable(exp, scope):
+    name = symbol_tostring(exp)
+    address = None
+    if scope is not None:
+        address = scope.resolve(name)
+    if address is None:
+        return analyze_global_variable(name)
+    depth, slot, var_scope = address
+    lookup = analyze_local_variable(depth, slot)
+    if slot < var_scope.nargs:
+        return lookup
+
+    # an internal definition may be referred before it is evaluated
+    return lambda env: checked_value(lookup(env), name)
+
+
+def checked_value(value, name):
+    if value is UNASSIGNED:
+        raise_error('Unassigned symbol: "%s"' % name)
+    return value
+
+
+def analyze_local_variable(depth, slot):
+    if depth == 0:
+        return lambda env: env.values[slot]
+    elif depth == 1:
+        return lambda env: env.enclosing.values[slot]
+    elif depth == 2:
+        return lambda env: env.enclosing.enclosing.values[slot]
+    else:
+        def lookup(env):
+            for _ in xrange(depth):
+                env = env.enclosing
+            return env.values[slot]
+        return lookup
+
+
+def analyze_global_variable(name):
+    return lambda env: global_lookup(env, name)
+
+
+def global_lookup(env, name):
+    genv = env.globals
+    try:
+        return genv.current_env[name]
+    except KeyError:
+        return genv.lookup(name)
+
+
 def is_quote(exp):
     return is_tagged_list(exp, KW.QUOTE)
 
 
-def analyze_quote(exp):
+def analyze_quote(exp, scope, tail=False):
     assert len(exp) == 2, str(exp)
     return lambda env: exp[1]
 
@@ -142,60 +289,96 @@ def env_put(env, symbol, value):
     return mkvoid()
 
 
+def frame_put(env, slot, value):
+    env.values[slot] = value
+    return mkvoid()
+
+
 # Two types of define:
 #   1, (define (f x) exps[x])
 #   2, (define a 1.0) or (define f (lambda (x) exps[x]))
-def analyze_define(exp):
+def analyze_define(exp, scope, tail=False):
     check_error(len(exp) >= 3)
     subexp = exp[1]
     if islist(subexp):
         check_error(len(subexp) > 0 and issymbol(subexp[0]))
         arguments = subexp[1:]
-        proc = make_procedure(arguments, exp[2:])
         name = symbol_tostring(subexp[0])
-        return lambda env: env_put(env, name, proc(env))
+        proc = make_procedure(arguments, exp[2:], scope, name)
     else:
         check_error(len(exp) == 3)
         check_error(issymbol(subexp))
-        proc = analyze(exp[2])
         name = symbol_tostring(subexp)
+        if is_lambda(exp[2]):
+            check_error(len(exp[2]) >= 3)
+            proc = make_procedure(exp[2][1], exp[2][2:], scope, name)
+        else:
+            proc = analyze(exp[2], scope)
+    if scope is None:
+        redefine(name)
         return lambda env: env_put(env, name, proc(env))
+    else:
+        # the internal definitions are found by scan_defines
+        # except the ones in unusual places
+        scope.add(name)
+        slot = scope.index[name]
+        return lambda env: frame_put(env, slot, proc(env))
 
 
 def is_begin(exp):
     return is_tagged_list(exp, KW.BEGIN)
 
 
-def analyze_begin(exp):
-    return analyze_seq(exp[1:])
+def analyze_begin(exp, scope, tail=False):
+    return analyze_seq(exp[1:], scope, tail)
 
 
 def is_load(exp):
     return is_tagged_list(exp, KW.LOAD)
 
 
-def analyze_load(exp):
+def analyze_load(exp, scope, tail=False):
+    check_error(len(exp) == 2)
+    get_fn = analyze(exp[1], scope)
+    return lambda env: load_file(env, get_fn(env))
+
+
+def load_file(env, fn):
+    check_error(isstring(fn))
+    # the file is always evaluated in the global environment
+    dofile(fn, env.globals)
+    return mkvoid()
+
+
+def is_require(exp):
+    return is_tagged_list(exp, KW.REQUIRE)
+
+
+def analyze_require(exp, scope, tail=False):
     check_error(len(exp) == 2)
-    get_fn = analyze(exp[1])
+    get_fn = analyze(exp[1], scope)
+    return lambda env: require_file(env, get_fn(env))
 
-    def load(env):
-        fn = get_fn(env)
-        check_error(isstring(fn))
-        dofile(fn, env)
-        return mkvoid()
 
-    return load
+def require_file(env, fn):
+    r'''
+    Load the file <fn> unless it has been loaded in the environment.
+    '''
+    check_error(isstring(fn))
+    if os.path.realpath(fn) not in env.globals.loaded:
+        dofile(fn, env.globals)
+    return mkvoid()
 
 
 def is_if(exp):
     return is_tagged_list(exp, KW.IF)
 
 
-def analyze_if(exp):
+def analyze_if(exp, scope, tail=False):
     check_error(len(exp) == 4)
-    predicate = analyze(exp[1])
-    consequent = analyze(exp[2])
-    alternative = analyze(exp[3])
+    predicate = analyze(exp[1], scope)
+    consequent = analyze(exp[2], scope, tail)
+    alternative = analyze(exp[3], scope, tail)
 
     def proc(env):
         if istrue(predicate(env)):
@@ -209,7 +392,7 @@ def is_cond(exp):
     return is_tagged_list(exp, KW.COND)
 
 
-def analyze_cond(exp):
+def analyze_cond(exp, scope, tail=False):
     check_error(False)  # TODO
 
 
@@ -217,71 +400,287 @@ def is_lambda(exp):
     return is_tagged_list(exp, KW.LAMBDA)
 
 
-def analyze_lambda(exp):
+def analyze_lambda(exp, scope, tail=False):
     check_error(len(exp) >= 3)
-    return make_procedure(exp[1], exp[2:])
+    return make_procedure(exp[1], exp[2:], scope)
+
+
+def is_profile(exp):
+    return is_tagged_list(exp, KW.PROFILE)
+
+
+def analyze_profile(exp, scope, tail=False):
+    check_error(len(exp) == 2)
+    proc = analyze(exp[1], scope)
+    return lambda env: run_profiled(proc, env)
+
+
+def run_profiled(proc, env):
+    r'''
+    Evaluate <proc> with the profiler and print the report.
+    '''
+    if is_profiling():
+        return proc(env)
+    profiler = start_profile()
+    try:
+        return proc(env)
+    finally:
+        stop_profile()
+        sys.stdout.write(profiler.report())
+
+
+class TailCall(object):
+    r'''
+    An application in tail position which is not done yet.
+    It is returned to _apply, which does it in the same Python frame.
+    '''
+    __slots__ = ('proc', 'args')
+
+    def __init__(self, proc, args):
+        self.proc = proc
+        self.args = args
+
+
+def analyze_application(exp, scope, tail):
+    is_constant, value = fold_constant(exp, scope)
+    if is_constant:
+        report_folding(exp, value)
+        return analyze_folded(value, lazy_call(exp, scope, tail))
+    return analyze_call(exp, scope, tail)
+
+
+def analyze_folded(value, unfolded):
+    r'''
+    <value> is used until a known primitive is redefined,
+    then <unfolded> is evaluated.
+    '''
+    version = __global_primitives_version
+
+    def folded(env):
+        if __global_primitives_version == version:
+            return value
+        return unfolded(env)
+    return folded
 
 
-def analyze_application(exp):
-    proc = analyze(exp[0])
-    args = map(analyze, exp[1:])
+def lazy_call(exp, scope, tail):
+    r'''
+    The application <exp> which is analyzed when it is evaluated
+    the first time.
+    '''
+    analyzed = []
+
+    def call(env):
+        if not analyzed:
+            analyzed.append(analyze_call(exp, scope, tail))
+        return analyzed[0](env)
+    return call
+
+
+def analyze_call(exp, scope, tail):
+    proc = analyze(exp[0], scope)
+    args = map(lambda e: analyze(e, scope), exp[1:])
+    primitive = known_primitive(exp[0], scope)
+    if primitive is not None:
+        check_primitive_argc(primitive, len(args))
+        if len(args) <= 3:
+            return analyze_primitive_call(primitive, proc, args, tail)
+    if tail:
+        return lambda env: TailCall(
+            proc(env),
+            map(lambda f: f(env), args))
     return lambda env: _apply(
         proc(env),
         map(lambda f: f(env), args))
 
 
+def analyze_primitive_call(primitive, proc, args, tail):
+    r'''
+    The application of a known primitive with at most 3 arguments:
+    the operation is called directly if <proc> still evaluates to
+    <primitive> and the profiler is off.
+    '''
+    operation = primitive.operation
+    fallback = TailCall if tail else _apply
+    if len(args) == 0:
+        def call(env):
+            p = proc(env)
+            if p is primitive and __global_profiler is None:
+                return operation()
+            return fallback(p, [])
+    elif len(args) == 1:
+        a, = args
+
+        def call(env):
+            p = proc(env)
+            if p is primitive and __global_profiler is None:
+                return operation(a(env))
+            return fallback(p, [a(env)])
+    elif len(args) == 2:
+        a, b = args
+
+        def call(env):
+            p = proc(env)
+            if p is primitive and __global_profiler is None:
+                return operation(a(env), b(env))
+            return fallback(p, [a(env), b(env)])
+    else:
+        a, b, c = args
+
+        def call(env):
+            p = proc(env)
+            if p is primitive and __global_profiler is None:
+                return operation(a(env), b(env), c(env))
+            return fallback(p, [a(env), b(env), c(env)])
+    return call
+
+
+def call_known_primitive(proc, primitive, args, tail):
+    r'''
+    Applies <proc> to <args>. The operation of the known <primitive> is
+    called directly if <proc> is still <primitive> and the profiler is off.
+    '''
+    if proc is primitive and __global_profiler is None:
+        return primitive.operation(*args)
+    if tail:
+        return TailCall(proc, args)
+    return _apply(proc, args)
+
+
+# call_known_primitive with 0 to 3 arguments, without building the list
+# of the arguments for the operation
+
+
+def call_known_primitive0(proc, primitive, tail):
+    if proc is primitive and __global_profiler is None:
+        return primitive.operation()
+    return call_known_primitive(proc, None, [], tail)
+
+
+def call_known_primitive1(proc, primitive, a, tail):
+    if proc is primitive and __global_profiler is None:
+        return primitive.operation(a)
+    return call_known_primitive(proc, None, [a], tail)
+
+
+def call_known_primitive2(proc, primitive, a, b, tail):
+    if proc is primitive and __global_profiler is None:
+        return primitive.operation(a, b)
+    return call_known_primitive(proc, None, [a, b], tail)
+
+
+def call_known_primitive3(proc, primitive, a, b, c, tail):
+    if proc is primitive and __global_profiler is None:
+        return primitive.operation(a, b, c)
+    return call_known_primitive(proc, None, [a, b, c], tail)
+
+
 def apply_primitive(proc, args):
-    check_error(proc.argc(len(args)),
-                '%s: incorrect argument count (Need: %s. Given: %s.)' % (
-                    tostring(proc), proc.argc.__doc__, len(args)))
-    return apply(proc.operation, args)
+    check_primitive_argc(proc, len(args))
+    return proc.operation(*args)
 
 
-def apply_compound(proc, args):
-    ext_env = proc.env.extend(
-        proc.args,
-        args)
-    return proc.body(ext_env)
+def check_primitive_argc(proc, argc):
+    if not proc.argc(argc):
+        raise_argc_error(tostring(proc), proc.argc.__doc__, argc)
 
 
-def analyze_seq(exps):
-    analyzed_exps = map(analyze, exps)
+def raise_argc_error(proc_name, need, given):
+    raise_error('%s: incorrect argument count (Need: %s. Given: %s.)' % (
+        proc_name, need, given))
+
+
+def apply_compound(proc, args):
+    nargs = len(proc.args)
+    if len(args) != nargs:
+        raise_argc_error(procedure_name(proc), nargs, len(args))
+    values = list(args)
+    ndefines = proc.scope.size() - nargs
+    if ndefines > 0:
+        values.extend([UNASSIGNED] * ndefines)
+    return proc.body(Frame(values, proc.env))
+
+
+def analyze_seq(exps, scope=None, tail=False):
+    if len(exps) == 0:
+        return lambda env: mkvoid()
+    analyzed_exps = map(lambda e: analyze(e, scope), exps[:-1])
+    last_exp = analyze(exps[-1], scope, tail)
 
     def eval_analyzed_exps(env):
-        res = mkvoid()
         for aexp in analyzed_exps:
-            res = aexp(env)
-        return res
+            aexp(env)
+        return last_exp(env)
 
     return eval_analyzed_exps
 
 
-def analyze(exp):
+def analyze(exp, scope=None, tail=False):
+    r'''
+    <scope> is the Scope of the procedure which <exp> is in,
+    or None if <exp> is at top level.
+    If <tail> is true, <exp> is in tail position of a procedure body
+    and an application in it evaluates to a TailCall.
+    '''
     if is_self_evaluating(exp):
         return lambda env: eval_self(exp)
     elif is_variable(exp):
-        return lambda env: env.lookup(symbol_tostring(exp))
-    elif is_quote(exp):
-        return analyze_quote(exp)
-    elif is_definition(exp):
-        return analyze_define(exp)
-    elif is_begin(exp):
-        return analyze_begin(exp)
-    elif is_load(exp):
-        return analyze_load(exp)
-    elif is_if(exp):
-        return analyze_if(exp)
-    elif is_cond(exp):
-        return analyze_cond(exp)
-    elif is_lambda(exp):
-        return analyze_lambda(exp)
-    elif ispair(exp):  # otherwise
-        return analyze_application(exp)
+        return analyze_variable(exp, scope)
+    elif ispair(exp):
+        head = exp[0]
+        if issymbol(head):
+            special_form = __global_special_forms.get(head)
+            if special_form is not None:
+                return special_form(exp, scope, tail)
+        return analyze_application(exp, scope, tail)
     else:
         raise_error('unknown exp type -- ANALYZE: %s' % exp)
 
 
+# compiler ################################################
+
+__global_compile = False
+
+
+def is_compiling():
+    return __global_compile
+
+
+def set_compile_mode(on):
+    r'''
+    If <on> is true, the expressions are compiled to Python functions
+    by ticompile instead of being analyzed.
+    '''
+    global __global_compile
+    __global_compile = on
+
+
+def special_forms(table):
+    r'''
+    Returns a dict which maps the interned keyword symbols
+    to the values of <table> (keyword => value).
+    '''
+    return dict((mksymbol(kw), v) for kw, v in table.items())
+
+
+# keyword symbol => analyzer of the special form
+__global_special_forms = special_forms({
+    KW.QUOTE: analyze_quote,
+    KW.DEFINE: analyze_define,
+    KW.BEGIN: analyze_begin,
+    KW.LOAD: analyze_load,
+    KW.REQUIRE: analyze_require,
+    KW.IF: analyze_if,
+    KW.COND: analyze_cond,
+    KW.LAMBDA: analyze_lambda,
+    KW.PROFILE: analyze_profile,
+})
+
+
 def eval_seq(exps, env):
+    if __global_compile:
+        from ticompile import compile_seq
+        return compile_seq(exps)(env)
     return analyze_seq(exps)(env)
 
 
@@ -290,14 +689,86 @@ def _eval(exp, env):
 
 
 def _apply(proc, args):
-    if isprimitive(proc):
+    if __global_profiler is not None:
+        return profiled_apply(proc, args)
+    res = apply_once(proc, args)
+    # trampoline: the tail calls are done here without growing the stack
+    while type(res) is TailCall:
+        res = apply_once(res.proc, res.args)
+    return res
+
+
+def apply_once(proc, args):
+    r'''
+    Returns the value or a TailCall.
+    '''
+    t = type(proc)
+    if t is Primitive:
         return apply_primitive(proc, args)
-    elif iscompound(proc):
+    elif t is Compound:
         return apply_compound(proc, args)
     else:
         raise_error('Not a procedure -- APPLY: %s' % proc)
 
 
+# profiler ################################################
+
+__global_profiler = None
+
+
+def is_profiling():
+    return __global_profiler is not None
+
+
+def start_profile():
+    r'''
+    Start recording every application. Returns the Profiler.
+    '''
+    global __global_profiler
+    __global_profiler = Profiler()
+    return __global_profiler
+
+
+def stop_profile():
+    r'''
+    Stop recording. Returns the Profiler.
+    '''
+    global __global_profiler
+    profiler = __global_profiler
+    __global_profiler = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+
+def procedure_name(proc):
+    if isprimitive(proc):
+        return proc.name
+    elif iscompound(proc) and proc.name is not None:
+        return proc.name
+    else:
+        return '#<lambda>'
+
+
+def profiled_apply(proc, args):
+    r'''
+    _apply while profiling. The frame of a procedure which returns
+    a TailCall stays open until the trampoline is done, so that
+    the time of the tail calls is in its cumulative time.
+    '''
+    profiler = __global_profiler
+    depth = profiler.depth()
+    try:
+        while True:
+            profiler.enter(procedure_name(proc))
+            res = apply_once(proc, args)
+            if type(res) is not TailCall:
+                return res
+            proc, args = res.proc, res.args
+    finally:
+        profiler.unwind(depth)
+
+
 # primitive procedures ####################################
 
 
@@ -406,7 +877,7 @@ Translate <datum> to string and print it.'''
 def _map(proc, seq):
     r'''(map proc seq):
 Returns [<proc>(e) for e in <seq>]'''
-    check_error(islist(seq))
+    check_error(isseq(seq))
     return map(lambda e: _apply(proc, mklist(e)), seq)
 
 
@@ -422,58 +893,195 @@ def _help(*args):
 
 
 def append(a, b):
-    check_error(islist(a))
-    check_error(islist(b))
+    check_error(isseq(a))
+    check_error(isseq(b))
     return list_append(a, b)
 
 
 def cons(a, seq):
-    check_error(
-        islist(seq),
-        'The second argument of cons must be a list. (Got: %s)' % seq)
+    if not isseq(seq):
+        raise_error(
+            'The second argument of cons must be a list. (Got: %s)' % seq)
     return list_cons(a, seq)
 
 
 def car(seq):
-    check_error(islist(seq))
-    check_error(not isnil(seq))
+    check_error(isseq(seq))
+    check_error(len(seq) != 0)
     return list_car(seq)
 
 
 def cdr(seq):
-    check_error(islist(seq))
-    check_error(not isnil(seq))
+    check_error(isseq(seq))
+    check_error(len(seq) != 0)
     return list_cdr(seq)
 
 
+def check_table(t, key=None):
+    if not istable(t):
+        raise_error('Expect a table but get %s' % tostring(t))
+    try:
+        hash(key)
+    except TypeError:
+        raise_error('The key of a table cannot be a list or a table. '
+                    '(Got: %s)' % tostring(key))
+
+
+def check_mutable_table(t, key):
+    check_table(t, key)
+    if not ismutable_table(t):
+        raise_error('The table is read-only: %s' % tostring(t))
+
+
+__global_no_default = object()
+
+
+def make_table():
+    r'''(make-table):
+Returns a new empty table. The keys are numbers, strings or symbols.
+The documents returned by the searches are tables too.'''
+    return mktable()
+
+
+def _table_ref(t, key, default=__global_no_default):
+    r'''(table-ref table key [default]):
+Returns the value of <key> in <table>, or <default> if <key> is not found.'''
+    check_table(t, key)
+    value = table_ref(t, key, default)
+    if value is __global_no_default:
+        raise_error('table-ref: key not found: %s' % tostring(key))
+    return value
+
+
+def _table_set(t, key, value):
+    r'''(table-set! table key value):
+Set the value of <key> in <table> to <value>.'''
+    check_mutable_table(t, key)
+    table_set(t, key, value)
+    return mkvoid()
+
+
+def table_update(t, key, proc, default=__global_no_default):
+    r'''(table-update! table key proc [default]):
+Set the value of <key> in <table> to (<proc> value), where value is
+the value of <key>, or <default> if <key> is not found.'''
+    check_mutable_table(t, key)
+    value = _table_ref(t, key, default)
+    table_set(t, key, _apply(proc, mklist(value)))
+    return mkvoid()
+
+
+def _table_delete(t, key):
+    r'''(table-delete! table key):
+Remove <key> from <table> if it is found.'''
+    check_mutable_table(t, key)
+    table_delete(t, key)
+    return mkvoid()
+
+
+def table_has_key(t, key):
+    r'''(table-has-key? table key):
+Returns true if <key> is in <table>.'''
+    check_table(t, key)
+    return mkboolean(table_haskey(t, key))
+
+
+def table_for_each(proc, t):
+    r'''(table-for-each proc table):
+Apply <proc> to each key and value of <table>.'''
+    check_table(t)
+    for key, value in t.items():
+        _apply(proc, mklist(key, value))
+    return mkvoid()
+
+
+def _table_keys(t):
+    r'''(table-keys table):
+Returns the list of the keys of <table>.'''
+    check_table(t)
+    return table_keys(t)
+
+
+def _table_values(t):
+    r'''(table-values table):
+Returns the list of the values of <table>.'''
+    check_table(t)
+    return table_values(t)
+
+
+def table_to_list(t):
+    r'''(table->list table):
+Returns the list of the (key value) of <table>.'''
+    check_table(t)
+    return table_items(t)
+
+
+def _table_count(t):
+    r'''(table-count table):
+Returns the number of the keys of <table>.'''
+    check_table(t)
+    return table_count(t)
+
+
+def eqv(x, y):
+    r'''(eqv? x y): Returns true if <x> and <y> are the same value.
+The lists are compared by their elements.'''
+    return mkboolean(identical(x, y) or (islist(x) and islist(y) and x == y))
+
+
 def primitive_procedures():
     PM = [
         ('void', mkvoid, eq_to(0)),
         ('help', _help, le_than(1)),
         ('display', display, eq_to(1)),
         ('map', _map, eq_to(2)),
-        ('+', number_add, _any),
-        ('-', number_minus, ge_than(1)),
-        ('*', number_multiply, _any),
-        ('/', number_divide, ge_than(1)),
-        ('%', number_remainder, eq_to(2)),
-        ('quotient', number_divide, ge_than(1)),
-        ('remainder', number_remainder, eq_to(2)),
-        ('=', equal, eq_to(2)),
-        ('<', lt, eq_to(2)),
-        ('<=', le, eq_to(2)),
-        ('>', gt, eq_to(2)),
-        ('>=', ge, eq_to(2)),
-        ('eqv?', lambda x, y: mkboolean(identical(x, y)), eq_to(2)),
+        ('+', number_add, _any, PURE),
+        ('-', number_minus, ge_than(1), PURE),
+        ('*', number_multiply, _any, PURE),
+        ('/', number_divide, ge_than(1), PURE),
+        ('%', number_remainder, eq_to(2), PURE),
+        ('quotient', number_divide, ge_than(1), PURE),
+        ('remainder', number_remainder, eq_to(2), PURE),
+        ('=', equal, eq_to(2), PURE),
+        ('<', lt, eq_to(2), PURE),
+        ('<=', le, eq_to(2), PURE),
+        ('>', gt, eq_to(2), PURE),
+        ('>=', ge, eq_to(2), PURE),
+        ('eqv?', eqv, eq_to(2), PURE),
         ('list', mklist, _any),
-        ('list?', lambda v: mkboolean(islist(v)), eq_to(1)),
-        ('null?', lambda v: mkboolean(isnil(v)), eq_to(1)),
-        ('pair?', lambda v: mkboolean(ispair(v)), eq_to(1)),
+        ('list?', lambda v: mkboolean(islist(v)), eq_to(1), PURE),
+        ('null?', lambda v: mkboolean(isnil(v)), eq_to(1), PURE),
+        ('pair?', lambda v: mkboolean(ispair(v)), eq_to(1), PURE),
         ('cons', cons, eq_to(2)),
-        ('car', car, eq_to(1)),
+        ('car', car, eq_to(1), PURE),
         ('cdr', cdr, eq_to(1)),
+        ('table?', lambda v: mkboolean(istable(v)), eq_to(1)),
+        ('make-table', make_table, eq_to(0)),
+        ('table-ref', _table_ref, inrange(2, 3)),
+        ('table-set!', _table_set, eq_to(3)),
+        ('table-update!', table_update, inrange(3, 4)),
+        ('table-delete!', _table_delete, eq_to(2)),
+        ('table-has-key?', table_has_key, eq_to(2)),
+        ('table-for-each', table_for_each, eq_to(2)),
+        ('table-keys', _table_keys, eq_to(1)),
+        ('table-values', _table_values, eq_to(1)),
+        ('table->list', table_to_list, eq_to(1)),
+        ('table-count', _table_count, eq_to(1)),
     ]
-    return map(lambda (s, b, a): (s, mkprimitive(s, a, b)), PM)
+    return mkprimitives(PM)
+
+
+# the optional 4th element of the entries of mkprimitives
+PURE = True
+
+
+def mkprimitives(PM):
+    r'''
+    <PM> is a list of (name, operation, argc) or
+    (name, operation, argc, PURE) if the primitive is pure.
+    Returns a list of (name, primitive).
+    '''
+    return map(lambda e: (e[0], mkprimitive(e[0], e[2], e[1], *e[3:])), PM)
 
 
 def buildin_values():
@@ -484,9 +1092,109 @@ def buildin_values():
     ]
 
 
+# known primitives ########################################
+
+# name => primitive, the primitives which are known at analysis time
+__global_known_primitives = {}
+# the names which are defined at top level
+__global_redefined = set()
+# increased when a known primitive is redefined
+__global_primitives_version = 0
+
+
+def register_primitives(primitives):
+    r'''
+    <primitives> is a list of (name, primitive).
+    The applications of a registered primitive are checked and specialized
+    at analysis time, so the same primitive objects should be put
+    into the environments. Returns <primitives>.
+    '''
+    __global_known_primitives.update(primitives)
+    return primitives
+
+
+def redefine(name):
+    global __global_primitives_version
+    if name in __global_known_primitives:
+        __global_primitives_version += 1
+    __global_redefined.add(name)
+
+
+def primitives_version():
+    return __global_primitives_version
+
+
+NOT_CONSTANT = (False, None)
+
+
+def fold_constant(exp, scope):
+    r'''
+    Returns (True, value) if <exp> is a literal or an application of a
+    pure known primitive to constant expressions, else (False, None).
+    '''
+    if is_self_evaluating(exp):
+        return True, exp
+    elif is_quote(exp) and len(exp) == 2:
+        return True, exp[1]
+    elif not ispair(exp):
+        return NOT_CONSTANT
+    primitive = known_primitive(exp[0], scope)
+    if (primitive is None or not primitive.pure or
+            not primitive.argc(len(exp) - 1)):
+        return NOT_CONSTANT
+    args = []
+    for arg in exp[1:]:
+        is_constant, value = fold_constant(arg, scope)
+        if not is_constant:
+            return NOT_CONSTANT
+        args.append(value)
+    try:
+        return True, primitive.operation(*args)
+    except Exception:
+        # the error is raised when the expression is evaluated
+        return NOT_CONSTANT
+
+
+# debug ###################################################
+
+__global_debug = False
+
+
+def set_debug(on):
+    r'''
+    If <on> is true, the analyzer reports the folded expressions.
+    '''
+    global __global_debug
+    __global_debug = on
+
+
+def report_folding(exp, value):
+    if __global_debug:
+        sys.stdout.write(
+            '[fold] %s => %s\n' % (tostring(exp), tostring(value)))
+
+
+def known_primitive(exp, scope):
+    r'''
+    Returns the registered primitive which the operator <exp> refers to,
+    or None if it is not a global variable or it may be redefined.
+    '''
+    if not issymbol(exp):
+        return None
+    name = symbol_tostring(exp)
+    if scope is not None and scope.resolve(name) is not None:
+        return None
+    if name in __global_redefined:
+        return None
+    return __global_known_primitives.get(name)
+
+
+__global_primitives = register_primitives(primitive_procedures())
+
+
 def setup_environment():
     global_env = Env()
-    global_values = primitive_procedures() + buildin_values()
+    global_values = __global_primitives + buildin_values()
     global_env.putall(global_values)
     return global_env
 
@@ -536,5 +1244,17 @@ def dostring(src, env):
 
 
 def dofile(fn, env):
-    with open(fn) as f:
-        dostring(f.read(), env)
+    r'''
+    The expressions are read (see ticache) and evaluated one by one.
+    <fn> is marked loaded in <env>, which is a global environment.
+    '''
+    from ticache import iter_file
+    path = os.path.realpath(fn)
+    # marked before the evaluation, so a file can require itself
+    env.loaded.add(path)
+    try:
+        for exp in iter_file(fn):
+            eval_seq([exp], env)
+    except BaseException:
+        env.loaded.discard(path)
+        raise
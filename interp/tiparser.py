@@ -1,3 +1,5 @@
+import re
+
 from tierror import TiError
 
 
@@ -12,9 +14,6 @@ def raise_parse_error(msg):
 
 from simpletable import enum
 
-# ignore spaces and comma
-t_ignore = ' \t\r'
-
 LPAREN = 'LPAREN'
 RPAREN = 'RPAREN'
 LBRACK = 'LBRACK'
@@ -35,58 +34,60 @@ TK = enum(
     'SYMBOL'
 )
 
-tokens = TK.keys()
-
-t_LPAREN = r'\('
-t_RPAREN = r'\)'
-t_LBRACK = r'\['
-t_RBRACK = r'\]'
-
-
-def t_comment(t):
-    r';.*'
-    t.lexer.lineno += 1
-
-
-def t_NUMBER(t):
-    r'[\+\-]?\d+\.?\d*'
-    try:
-        t.value = int(t.value)
-    except ValueError:
-        t.value = float(t.value)
-    return t
-
-
-def t_STRING(t):
-    r'"[^"]*"'
-    t.value = t.value[1:-1]
-    return t
-
-
-t_QUOTE = '\''
-
 
 def symbol_chars(ext):
     return r'[%sa-zA-Z=<>\*\+\-/%%]' % ext
 
-t_SYMBOL = '%s%s*' % (symbol_chars(''), symbol_chars(r'0-9!\?'))
-
-
-def t_newline(t):
-    r'\n+'
-    t.lexer.lineno += len(t.value)
-
-
-def t_error(t):
-    raise_parse_error('Illegal character "%s"' % t.value[0])
 
-
-import ply.lex as lex
-__global_lexer = lex.lex()
-
-
-def new_lexer():
-    return __global_lexer.clone()
+# The alternatives are tried in order at each position.
+# Spaces, tabs and \r are ignored.
+TOKEN_REGEX = re.compile('|'.join([
+    r'(?P<IGNORE>[ \t\r]+)',
+    r'(?P<COMMENT>;.*)',
+    r'(?P<NUMBER>[\+\-]?\d+\.?\d*)',
+    r'(?P<STRING>"[^"]*")',
+    r'(?P<NEWLINE>\n+)',
+    r'(?P<SYMBOL>%s%s*)' % (symbol_chars(''), symbol_chars(r'0-9!\?')),
+    r'(?P<LPAREN>\()',
+    r'(?P<RPAREN>\))',
+    r'(?P<LBRACK>\[)',
+    r'(?P<RBRACK>\])',
+    r"(?P<QUOTE>')",
+]))
+
+
+def tokenize(text):
+    r'''
+    Yields (type, value, lineno) of the tokens of <text>.
+    The values of NUMBER and STRING tokens are converted.
+    '''
+    match = TOKEN_REGEX.match
+    pos = 0
+    end = len(text)
+    lineno = 1
+    while pos < end:
+        m = match(text, pos)
+        if m is None:
+            raise_parse_error('Illegal character "%s"' % text[pos])
+        pos = m.end()
+        t = m.lastgroup
+        if t == 'IGNORE':
+            continue
+        elif t == 'NEWLINE':
+            lineno += pos - m.start()
+        elif t == 'COMMENT':
+            # the newline after the comment is counted too
+            lineno += 1
+        elif t == NUMBER:
+            value = m.group()
+            try:
+                yield NUMBER, int(value), lineno
+            except ValueError:
+                yield NUMBER, float(value), lineno
+        elif t == STRING:
+            yield STRING, m.group()[1:-1], lineno
+        else:
+            yield t, m.group(), lineno
 
 
 class Token(object):
@@ -102,119 +103,115 @@ class Token(object):
         return '<%s, "%s", %s>' % (self.type, self.value, self.lineno)
 
 
-def lex_to_tokens(t):
-    return Token(t.type, t.value, t.lineno)
-
-
 def scan(text):
-    lexer = new_lexer()
-    lexer.input(text)
-    buf = []
-    while True:
-        tok = lexer.token()
-        if not tok:
-            break
-        buf.append(tok)
-    return map(lex_to_tokens, buf)
+    return [Token(t, v, lineno) for t, v, lineno in tokenize(text)]
 ###########################################################
 
 
 # parse ###################################################
 from tikeyword import KW
 
-
-def parse(text):
-    tokens = scan(text)
-    token_tree = build_tree(tokens)
-    translated_tree = translate_quote(token_tree)
-    return parse_tree(translated_tree)
-
-
-def mk_symbol_token(s, lineno):
-    return Token(SYMBOL, s, lineno)
-
-
-def build_tree(tokens):
-    num_tokens = len(tokens)
-    token_tree = []
-
-    def parse_start(start):
-        node = []
-        i = start
-        while i < num_tokens:
-            t = tokens[i]
-            if t.type in (LPAREN, LBRACK):
-                child, i = parse_start(i + 1)
-                if t.type == LBRACK:
-                    child.insert(0, mk_symbol_token('list', t.lineno))
-                node.append(child)
-            elif t.type in (RPAREN, RBRACK):
-                return node, i + 1
-            else:
-                node.append(t)
-                i += 1
-        return node, num_tokens
-
-    def is_all_rparen(start, end):
-        r'''
-        Returns whether all the tokens have type RPAREN in tokens[start:end]
-        '''
-        return all(map(
-            lambda i: tokens[i].type == RPAREN,
-            xrange(start, end)))
-
-    token_tree, end = parse_start(0)
-
-    if not (end == num_tokens or is_all_rparen(end, num_tokens)):
-        raise_parse_error("Syntax error: check the parentheses")
-
-    return token_tree
-
-
-def translate_quote(lst):
-    n = len(lst)
-
-    def __iter(start):
-        if start < n:
-            node = lst[start]
-            rest = __iter(start + 1)
-            if isinstance(node, list):
-                rest.insert(0, translate_quote(node))
-            elif node.type == QUOTE:
-                if start + 1 >= n:
-                    raise_parse_error("Syntaxe error: nothing follows quote")
-                quote_node = mk_symbol_token(KW.QUOTE, node.lineno)
-                rest[0] = [quote_node, rest[0]]
-            else:
-                rest.insert(0, node)
-            return rest
-        else:
-            return []
-
-    return __iter(0)
-
-
 from titype import (
-    mknumber, mkstring, mksymbol, mklist
+    mksymbol, mklist
 )
 
+PAREN_ERROR = "Syntax error: check the parentheses"
+QUOTE_ERROR = "Syntaxe error: nothing follows quote"
 
-def parse_tree(node):
 
-    def parse_token(token):
-        if token.type == NUMBER:
-            return mknumber(token.value)
-        elif token.type == STRING:
-            return mkstring(token.value)
-        elif token.type == SYMBOL:
-            return mksymbol(token.value)
+def parse(text):
+    r'''
+    Returns the list of the expressions in <text>.
+    An unclosed list is closed at the end.
+    After a closing parenthesis without its opening one,
+    only closing parentheses are allowed.
+    The illegal characters are reported before the errors of
+    parentheses, which are reported before the errors of quotes.
+    '''
+    return list(read_forms(list(tokenize(text))))
+
+
+def iter_parse(text):
+    r'''
+    Yields the expressions in <text> one by one. An error is raised
+    when it is read, after the expressions before it are yielded.
+    '''
+    return read_forms(tokenize(text), True)
+
+
+def read_forms(tokens, stream=False):
+    r'''
+    Yields the top-level expressions read from <tokens>, an iterable of
+    (type, value, lineno). It is iterative and takes linear time.
+    If <stream> is false, the errors are raised after all the tokens
+    are read.
+    '''
+    quote_symbol = mksymbol(KW.QUOTE)
+    list_symbol = mksymbol('list')
+    lists = [None]  # the lists being read, None for the top level
+    quotes = [0]  # the number of quotes before the next element of each list
+    closed = False
+    paren_error = False
+    quote_error = False
+
+    for t, value, lineno in tokens:
+        if closed:
+            if t != RPAREN:
+                if stream:
+                    raise_parse_error(PAREN_ERROR)
+                paren_error = True
+            continue
+        if t == SYMBOL:
+            value = mksymbol(value)
+        elif t == LPAREN:
+            lists.append(mklist())
+            quotes.append(0)
+            continue
+        elif t == LBRACK:
+            lists.append(mklist(list_symbol))
+            quotes.append(0)
+            continue
+        elif t == QUOTE:
+            quotes[-1] += 1
+            continue
+        elif t == RPAREN or t == RBRACK:
+            if quotes.pop() > 0:
+                if stream:
+                    raise_parse_error(QUOTE_ERROR)
+                quote_error = True
+            if len(lists) == 1:
+                closed = True
+                continue
+            value = lists.pop()
+        n = quotes[-1]
+        if n > 0:
+            for _ in xrange(n):
+                value = mklist(quote_symbol, value)
+            quotes[-1] = 0
+        if len(lists) == 1:
+            yield value
         else:
-            raise_parse_error('Unknown token type: %s' % token.type)
-
-    if isinstance(node, list):
-        buf = mklist()
-        for n in node:
-            buf.append(parse_tree(n))
-        return buf
-    else:
-        return parse_token(node)
+            lists[-1].append(value)
+
+    if not closed:
+        while len(lists) > 1:
+            if quotes.pop() > 0:
+                quote_error = True
+            value = lists.pop()
+            n = quotes[-1]
+            for _ in xrange(n):
+                value = mklist(quote_symbol, value)
+            quotes[-1] = 0
+            if quote_error and stream:
+                break
+            if len(lists) == 1:
+                yield value
+            else:
+                lists[-1].append(value)
+        if quotes[-1] > 0:
+            quote_error = True
+
+    if paren_error:
+        raise_parse_error(PAREN_ERROR)
+    if quote_error:
+        raise_parse_error(QUOTE_ERROR)
@@ -0,0 +1,98 @@
+import json
+import time
+
+
+class Profiler(object):
+    r'''
+    Records the number of calls, the self time and the cumulative time
+    of each procedure applied while it is running.
+    The cumulative time of a recursive procedure is only counted
+    for the outermost call. The cumulative time of a procedure includes
+    the tail calls it returns (see profiled_apply).
+    '''
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.stats = {}  # name => [calls, self time, cumulative time]
+        self.stack = []  # frames: [name, start time, time of children]
+        self.active = {}  # name => number of frames of <name> in the stack
+        self.start_time = clock()
+        self.total = None
+
+    def call(self, name, func, *args):
+        self.enter(name)
+        try:
+            return func(*args)
+        finally:
+            self.leave()
+
+    def enter(self, name):
+        r'''
+        Opens a frame of <name>, which is recorded when it is left.
+        '''
+        self.stack.append([name, self.clock(), 0.0])
+        self.active[name] = self.active.get(name, 0) + 1
+
+    def leave(self):
+        name, start, children = self.stack.pop()
+        elapsed = self.clock() - start
+        self.active[name] -= 1
+        try:
+            st = self.stats[name]
+        except KeyError:
+            st = self.stats[name] = [0, 0.0, 0.0]
+        st[0] += 1
+        st[1] += elapsed - children
+        if self.active[name] == 0:
+            st[2] += elapsed
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+    def depth(self):
+        return len(self.stack)
+
+    def unwind(self, depth):
+        r'''
+        Leaves the frames above <depth>.
+        '''
+        while len(self.stack) > depth:
+            self.leave()
+
+    def stop(self):
+        self.total = self.clock() - self.start_time
+
+    def total_time(self):
+        if self.total is None:
+            return self.clock() - self.start_time
+        return self.total
+
+    def rows(self):
+        r'''
+        Returns [(name, calls, self time, cumulative time)]
+        sorted by the cumulative time.
+        '''
+        rows = map(lambda (name, st): (name, st[0], st[1], st[2]),
+                   self.stats.items())
+        rows.sort(key=lambda r: (-r[3], -r[2], r[0]))
+        return rows
+
+    def report(self):
+        lines = ['Total time: %.6fs' % self.total_time(),
+                 '%-32s %10s %12s %12s' % (
+                     'procedure', 'calls', 'self', 'cumulative')]
+        for name, calls, self_time, cum_time in self.rows():
+            lines.append('%-32s %10d %12.6f %12.6f' % (
+                name, calls, self_time, cum_time))
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        return json.dumps({
+            'total': self.total_time(),
+            'procedures': map(
+                lambda (name, calls, self_time, cum_time): {
+                    'name': name,
+                    'calls': calls,
+                    'self': self_time,
+                    'cumulative': cum_time,
+                },
+                self.rows()),
+        }, indent=2)
@@ -1,9 +1,9 @@
 #
 
+import itertools
 import pprint
 
-from simpletable import enum, SimpleTable
-table = SimpleTable
+from simpletable import enum
 
 TYPE = enum(
     # immutable types
@@ -26,10 +26,13 @@ def identical(a, b):
     return type(a) == type(b) and a == b
 
 
-class TiType(table):
-    def __init__(self, _type, **kwargs):
-        self.update(kwargs)
-        self.type = _type
+class TiType(object):
+    r'''
+    The base of the values which are not values in python.
+    <type> is one of TYPE and is set by the subclasses.
+    '''
+    __slots__ = ()
+    type = None
 
 
 def check_type(st, _type):
@@ -124,6 +127,10 @@ def isstring(s):
 
 
 class Symbol(str):
+    r'''
+    Use mksymbol to make a symbol, so the symbols with the same name
+    are the same object.
+    '''
     def __init__(self, s):
         super(Symbol, self).__init__(s)
 
@@ -134,16 +141,34 @@ class Symbol(str):
         return super(Symbol, self).__str__()
 
     def __eq__(self, v):
-        if issymbol(v):
-            symbol_tostring(self) == symbol_tostring(v)
+        if self is v:
+            return True
+        elif issymbol(v):
+            return symbol_tostring(self) == symbol_tostring(v)
         elif isstring(v):
             return symbol_tostring(self) == v
         else:
             return False
 
+    def __ne__(self, v):
+        return not self.__eq__(v)
+
+    __hash__ = str.__hash__
+
+    def __reduce__(self):
+        # the unpickled symbols are interned
+        return mksymbol, (str(self),)
+
+
+# name => Symbol
+__global_symbols = {}
+
 
 def mksymbol(s):
-    return Symbol(s)
+    try:
+        return __global_symbols[s]
+    except KeyError:
+        return __global_symbols.setdefault(s, Symbol(s))
 
 
 def issymbol(v):
@@ -164,35 +189,63 @@ def symbol_eqs(a, b):
 
 # procedure ###############################################
 
-# struct of compound procedure:
-#   table(
-#     args: is a list of strings,
-#     body: is a analyzed function,
-#     env
-#   )
-def mkcompound(args, proc, env):
-    return TiType(TYPE.COMPOUND,
-                  args=args, body=proc, env=env)
+class Compound(TiType):
+    r'''
+    args: is a list of strings,
+    body: is a analyzed function,
+    env,
+    name: a string or None,
+    scope: the names of the slots of the frame of a call
+    '''
+    __slots__ = ('args', 'body', 'env', 'name', 'scope')
+    type = TYPE.COMPOUND
+
+    def __init__(self, args, body, env, name, scope):
+        self.args = args
+        self.body = body
+        self.env = env
+        self.name = name
+        self.scope = scope
+
+    def __repr__(self):
+        return '#<procedure>'
+
+
+def mkcompound(args, proc, env, name=None, scope=None):
+    return Compound(args, proc, env, name, scope)
 
 
 def iscompound(var):
-    return check_type(var, TYPE.COMPOUND)
+    return type(var) is Compound
+
+
+class Primitive(TiType):
+    r'''
+    name: a string
+    argc: a function that check the number of arguments
+    operation: a function with <argc> arguments
+    pure: true if the result depends only on the arguments
+          and the operation has no side effect
+    '''
+    __slots__ = ('name', 'argc', 'operation', 'pure')
+    type = TYPE.PRIMITIVE
+
+    def __init__(self, name, argc, operation, pure):
+        self.name = name
+        self.argc = argc
+        self.operation = operation
+        self.pure = pure
+
+    def __repr__(self):
+        return '#<procedure %s>' % self.name
 
 
-# struct of primitive procedure:
-#   table(
-#     type: 'primitive'
-#     name: a string
-#     argc: a function that check the number of arguments
-#     operation: a function with <argc> arguments
-#   )
-def mkprimitive(name, argc, operation):
-    return TiType(TYPE.PRIMITIVE,
-                  name=name, argc=argc, operation=operation)
+def mkprimitive(name, argc, operation, pure=False):
+    return Primitive(name, argc, operation, pure)
 
 
 def isprimitive(var):
-    return check_type(var, TYPE.PRIMITIVE)
+    return type(var) is Primitive
 
 
 def isprocedure(var):
@@ -200,7 +253,111 @@ def isprocedure(var):
 
 
 # list ####################################################
-# use the list in python
+# A list is a list in python, or a persistent list made by list_cons
+# and list_cdr which shares its tail with other lists, so they are O(1).
+# The lists are never modified. The empty list is always a list in python.
+
+
+class PersistentList(object):
+    r'''
+    The base of Pair and ListTail.
+    They are compared and printed like the lists in python.
+    '''
+    __slots__ = ()
+
+    def __getitem__(self, i):
+        n = len(self)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(n)
+            if step < 0:
+                return list(self)[i]
+            return list(itertools.islice(self, start, stop, step))
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('list index out of range')
+        return self.nth(i)
+
+    def __eq__(self, v):
+        return islist(v) and list(self) == list_topython(v)
+
+    def __ne__(self, v):
+        return not self.__eq__(v)
+
+    def __lt__(self, v):
+        return list(self) < list_topython(v)
+
+    def __le__(self, v):
+        return list(self) <= list_topython(v)
+
+    def __gt__(self, v):
+        return list(self) > list_topython(v)
+
+    def __ge__(self, v):
+        return list(self) >= list_topython(v)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __reduce__(self):
+        return mklist, tuple(self)
+
+
+class Pair(PersistentList):
+    r'''
+    <car> followed by the elements of the list <cdr>.
+    '''
+    __slots__ = ('car', 'cdr', 'length')
+
+    def __init__(self, car, cdr):
+        self.car = car
+        self.cdr = cdr
+        self.length = 1 + len(cdr)
+
+    def __len__(self):
+        return self.length
+
+    def nth(self, i):
+        seq = self
+        while type(seq) == Pair:
+            if i == 0:
+                return seq.car
+            seq = seq.cdr
+            i -= 1
+        return seq[i]
+
+    def __iter__(self):
+        seq = self
+        while type(seq) == Pair:
+            yield seq.car
+            seq = seq.cdr
+        for e in seq:
+            yield e
+
+
+class ListTail(PersistentList):
+    r'''
+    The elements of the list in python <items> from <start>.
+    '''
+    __slots__ = ('items', 'start')
+
+    def __init__(self, items, start):
+        self.items = items
+        self.start = start
+
+    def __len__(self):
+        return len(self.items) - self.start
+
+    def nth(self, i):
+        return self.items[self.start + i]
+
+    def __iter__(self):
+        return itertools.islice(self.items, self.start, None)
+
+
+__global_list_types = (list, Pair, ListTail)
 
 
 def mklist(*args):
@@ -211,15 +368,46 @@ Make a list of <a>s.'''
 
 def islist(var):
     # Cannot use isinstance(var, list)!!
-    return type(var) == list
+    return type(var) in __global_list_types
+
+
+def isseq(var):
+    r'''
+    Returns true if <var> is a list or a list in python returned by
+    the primitives, like the result of search-hits.
+    '''
+    return islist(var) or isinstance(var, list)
 
 
 def mknil():
     return mklist()
 
 
+def list_topython(seq):
+    r'''
+    Returns <seq> as a list in python.
+    The elements are not converted.
+    '''
+    if isinstance(seq, PersistentList):
+        return list(seq)
+    return seq
+
+
+def list_todata(v):
+    r'''
+    Converts the lists in <v> (and in its elements) to lists in python,
+    and the table views to their dicts.
+    '''
+    if islist(v):
+        return map(list_todata, v)
+    todict = __global_table_views.get(type(v))
+    if todict is not None:
+        return todict(v)
+    return v
+
+
 def list_tostring(var):
-    return pprint.pformat(var)
+    return pprint.pformat(list_todata(var))
 
 
 def isnil(var):
@@ -241,30 +429,87 @@ def list_append(a, b):
 
 
 def list_cons(a, seq):
-    res = mklist(*seq)
-    res.insert(0, a)
-    return res
+    return Pair(a, seq)
 
 
 def list_car(seq):
+    if type(seq) == Pair:
+        return seq.car
     return seq[0]
 
 
 def list_cdr(seq):
-    return seq[1:]
+    t = type(seq)
+    if t == Pair:
+        return seq.cdr
+    elif t == ListTail:
+        items, start = seq.items, seq.start + 1
+    else:
+        items, start = seq, 1
+    if start == len(items):
+        return mknil()
+    return ListTail(items, start)
 
 
 # table ###################################################
-# use the dict in python
+# use the dict in python. The read-only views of dicts, like the
+# documents returned by the searches, are tables too.
+
+# the class of a table view => the function which returns its dict
+__global_table_views = {}
+
+
+def register_table_view(cls, todict):
+    r'''
+    The instances of <cls> are read-only tables. They have the methods
+    get, keys, values, iteritems and items of dict.
+    '''
+    __global_table_views[cls] = todict
 
 
 def mktable():
-    assert False  # TODO
+    return {}
 
 
 def istable(var):
-    return isinstance(var, dict)  # TODO
+    return isinstance(var, dict) or type(var) in __global_table_views
+
+
+def ismutable_table(var):
+    return isinstance(var, dict)
 
 
 def table_tostring(var):
-    return pprint.pformat(var)
+    return pprint.pformat(list_todata(var))
+
+
+def table_haskey(t, key):
+    return key in t
+
+
+def table_ref(t, key, default=None):
+    return t.get(key, default)
+
+
+def table_set(t, key, value):
+    t[key] = value
+
+
+def table_delete(t, key):
+    t.pop(key, None)
+
+
+def table_keys(t):
+    return t.keys()
+
+
+def table_values(t):
+    return t.values()
+
+
+def table_items(t):
+    return map(list, t.iteritems())
+
+
+def table_count(t):
+    return len(t)
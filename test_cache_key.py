@@ -0,0 +1,21 @@
+#!/usr/bin/env python
+# The keys of the query cache are the same in every process,
+# so the disk cache still hits after a restart.
+
+import subprocess
+import sys
+
+BUILD_KEY = '''
+import tieslib.tieslib as T
+print T.cache_key({'query': {'match_all': {}}, 'size': 3})
+'''
+
+
+def key_in_new_process():
+    return subprocess.check_output([sys.executable, '-c', BUILD_KEY])
+
+
+first = key_in_new_process()
+second = key_in_new_process()
+print first
+print 'same key:', first == second
@@ -2,10 +2,56 @@
 
 import sys
 
+from common.startuptrace import StartupTrace
+
+# installed before the other imports to time them
+if '--startup-trace' in sys.argv[1:]:
+    startup_trace = StartupTrace()
+    startup_trace.install()
+else:
+    startup_trace = None
+
 from tieslib.tieslib import (
     prompt, setup_ties_environment
 )
 from interp.interp import newenv_with_preload, driver_loop
+from interp.tilib import start_profile, stop_profile, set_compile_mode
+from interp.ticache import DEFAULT_CACHE_DIR, set_form_cache_dir
+
+
+def parse_argv(argv):
+    r'''
+    Returns (profile, compile_mode, cache_dir, fns).
+    --profile: print the profile report when exits.
+    --profile=out.json: write the profile report to out.json as JSON.
+    --compile: compile the expressions to Python functions.
+    --cache-dir=dir: the directory of the cache of the parsed files
+                     ($TIES_CACHE_DIR or ~/.ties_cache by default).
+    --no-cache: do not cache the parsed files.
+    --startup-trace: print the time of the imports and of the
+                     initialization of the environment.
+    The other arguments are the files to preload.
+    '''
+    profile = None
+    compile_mode = False
+    cache_dir = DEFAULT_CACHE_DIR
+    fns = []
+    for arg in argv:
+        if arg == '--profile':
+            profile = '-'
+        elif arg == '--compile':
+            compile_mode = True
+        elif arg == '--no-cache':
+            cache_dir = None
+        elif arg.startswith('--cache-dir='):
+            cache_dir = arg.split('=', 1)[1]
+        elif arg == '--startup-trace':
+            pass  # see the top of the file
+        elif arg.startswith('--profile='):
+            profile = arg.split('=', 1)[1]
+        else:
+            fns.append(arg)
+    return profile, compile_mode, cache_dir, fns
 
 
 def input_prompt():
@@ -13,26 +59,63 @@ def input_prompt():
 
 ### Load and save history file ############################
 import os
-import readline
-histfile = os.path.join(os.path.expanduser('~'), '.ties_history')
-try:
-    readline.read_history_file(histfile)
-except IOError:
-    pass
 import atexit
+histfile = os.path.join(os.path.expanduser('~'), '.ties_history')
 
 
-def write_history():
+def setup_history():
+    r'''
+    Called just before the interactive loop, which imports readline.
+    '''
+    import readline
     try:
-        readline.write_history_file(histfile)
+        readline.read_history_file(histfile)
     except IOError:
         pass
 
-atexit.register(write_history)
+    def write_history():
+        try:
+            readline.write_history_file(histfile)
+        except IOError:
+            pass
+
+    atexit.register(write_history)
 ###########################################################
 
-newenv = newenv_with_preload(setup_ties_environment, sys.argv[1:])
+profile, compile_mode, cache_dir, fns = parse_argv(sys.argv[1:])
+set_compile_mode(compile_mode)
+set_form_cache_dir(cache_dir)
+if profile is not None:
+    start_profile()
+
+    def write_profile():
+        profiler = stop_profile()
+        if profile == '-':
+            sys.stderr.write(profiler.report())
+        else:
+            with open(profile, 'w') as f:
+                f.write(profiler.to_json())
+
+    atexit.register(write_profile)
+
+newenv = newenv_with_preload(setup_ties_environment, fns)
+if startup_trace is not None:
+    newenv_untraced = newenv
+
+    def newenv():
+        r'''
+        Print the report when the first environment is ready.
+        '''
+        global startup_trace
+        if startup_trace is None:
+            return newenv_untraced()
+        env = startup_trace.timed('init', 'environment', newenv_untraced)
+        startup_trace.uninstall()
+        sys.stderr.write(startup_trace.report())
+        startup_trace = None
+        return env
 print 'TiES Interpreter Version 0.0'
 print 'Copyleft (c) balabala'
 print
+setup_history()
 driver_loop(newenv, input_prompt)
@@ -0,0 +1,172 @@
+import math
+import time
+import threading
+from collections import deque
+
+from common.container import Table
+
+# phases of a query, in order
+PHASES = [
+    'parse_args',
+    'translate',
+    'cache',
+    'serialize',
+    'network',
+    'took',
+    'decode',
+    'format',
+    'post_process',
+]
+
+DEFAULT_HISTORY_SIZE = 1000
+
+
+class QueryRecord(object):
+    r'''
+    The timings (in seconds) of the phases of one query,
+    the size of the response and the number of hits.
+    '''
+    def __init__(self, kind):
+        self.kind = kind
+        self.phases = {}
+        self.response_bytes = 0
+        self.hits = None
+        self.start = time.time()
+        self.total = None
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def finish(self):
+        self.total = time.time() - self.start
+
+    def timed(self, phase, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.add(phase, time.time() - start)
+
+    def to_table(self):
+        t = Table()
+        t.kind = self.kind
+        t.total = to_ms(self.total)
+        t.phases = Table(dict(map(
+            lambda (phase, seconds): (phase, to_ms(seconds)),
+            self.phases.items())))
+        t.response_bytes = self.response_bytes
+        t.hits = self.hits
+        return t
+
+
+class QueryStats(object):
+    r'''
+    Keeps the last <size> records of each kind of query.
+    The record of the query running in the current thread
+    is current().
+    '''
+    def __init__(self, size=DEFAULT_HISTORY_SIZE):
+        self.size = size
+        self.records = {}  # kind => deque of QueryRecord
+        self.local = threading.local()
+
+    def current(self):
+        return getattr(self.local, 'record', None)
+
+    def begin(self, kind):
+        record = QueryRecord(kind)
+        self.local.record = record
+        return record
+
+    def end(self, record):
+        r'''
+        <record> may not be the current one, e.g. the record of
+        a query whose results are streamed.
+        '''
+        record.finish()
+        if self.current() is record:
+            self.local.record = None
+        try:
+            records = self.records[record.kind]
+        except KeyError:
+            records = self.records[record.kind] = deque(maxlen=self.size)
+        records.append(record)
+
+    def add(self, phase, seconds):
+        record = self.current()
+        if record is not None:
+            record.add(phase, seconds)
+
+    def timed(self, phase, func, *args):
+        start = time.time()
+        try:
+            return func(*args)
+        finally:
+            self.add(phase, time.time() - start)
+
+    def within(self, record, func, *args):
+        r'''
+        Call func(*args) with <record> as the current record of this
+        thread, e.g. a part of a query which runs in another thread.
+        '''
+        saved = self.current()
+        self.local.record = record
+        try:
+            return func(*args)
+        finally:
+            self.local.record = saved
+
+    def clear(self):
+        self.records.clear()
+
+    def summary(self):
+        r'''
+        Returns a Table: kind => the percentiles of the latency,
+        of each phase (in milliseconds), of the response size
+        and of the number of hits.
+        '''
+        res = Table()
+        for kind, records in self.records.items():
+            s = Table()
+            s.count = len(records)
+            s.latency = percentiles(map(lambda r: to_ms(r.total), records))
+            phases = Table()
+            for phase in PHASES:
+                values = map(lambda r: to_ms(r.phases[phase]),
+                             filter(lambda r: phase in r.phases, records))
+                if values:
+                    phases[phase] = percentiles(values)
+            s.phases = phases
+            s.response_bytes = percentiles(
+                map(lambda r: r.response_bytes, records))
+            hits = filter(lambda h: h is not None,
+                          map(lambda r: r.hits, records))
+            if hits:
+                s.hits = percentiles(hits)
+            res[kind] = s
+        return res
+
+
+def to_ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+def percentile(sorted_values, p):
+    r'''
+    Nearest-rank percentile of a sorted non-empty list.
+    '''
+    n = len(sorted_values)
+    rank = int(math.ceil(p / 100. * n)) - 1
+    return sorted_values[max(0, min(n - 1, rank))]
+
+
+def percentiles(values):
+    t = Table()
+    if not values:
+        return t
+    values = sorted(values)
+    t.p50 = percentile(values, 50)
+    t.p90 = percentile(values, 90)
+    t.p99 = percentile(values, 99)
+    t.max = values[-1]
+    return t
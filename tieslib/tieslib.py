@@ -1,5 +1,7 @@
+import sys
 import pprint
-import elasticsearch as ES
+import time
+import threading
 
 from translator.translator import (
     translate,
@@ -9,23 +11,31 @@ from translator.translator import (
 )
 from translator.post_process import (
     _format,
-    hits_additional_info, hits_sources,
+    hits_additional_info, hits_sources, iter_hits_sources,
     facet_terms_additional_info, facet_terms,
     facet_entries,
 )
 from interp.tilib import (
     _any, ge_than, eq_to, inrange,
     setup_environment,
+    mkprimitives, PURE, register_primitives,
+    set_debug,
+    _apply,
     check_error, raise_error,
 )
 from interp.titype import (
     mkvoid, isvoid,
     mkfalse, istrue,
     issymbol, symbol_tostring,
-    mklist,
-    mkprimitive,
+    mklist, islist, list_topython,
+    mktable, register_table_view,
 )
-from common.container import Table
+from common.container import Table, TableView, unwrap
+from common.cache import LRUCache, DiskCache
+from common.lazy import lazy_import
+from connection.esjson import dumps as json_dumps, ArrayStream, ESSerializer
+from connection.nodes import NodeStats, NodeSet
+from querystats import QueryStats, QueryRecord
 
 
 def tiesproc(f):
@@ -75,27 +85,70 @@ def dbg_print(msg, data):
 @tiesproc
 def debug_mode_on():
     buildin_values.debug_mode = True
+    set_debug(True)
     return mkvoid()
 
 
 @tiesproc
 def debug_mode_off():
     buildin_values.debug_mode = False
+    set_debug(False)
     return mkvoid()
 
 
 ES_DEFAULT_PORT = '9200'
 buildin_values.url = 'localhost'
 buildin_values.port = ES_DEFAULT_PORT
+buildin_values.nodes = [(buildin_values.url, buildin_values.port)]
 buildin_values.index = '*'
 buildin_values.doc_type = mkvoid()
+buildin_values.es_pool_size = 10
+buildin_values.es_timeout = 10
+buildin_values.es_dead_timeout = 30
+
+
+def parse_node(node):
+    r'''
+    "host:port" or "host" => (host, port)
+    '''
+    check_error(isinstance(node, str), 'Expect "host:port" but get %s' % node)
+    if ':' in node:
+        host, port = node.rsplit(':', 1)
+        return (host, port)
+    else:
+        return (node, ES_DEFAULT_PORT)
 
 
 @tiesproc
 def connect(url, port=ES_DEFAULT_PORT):
-    r'''(connect url port): <url> and <port> are strings.'''
-    buildin_values.url = url
-    buildin_values.port = port
+    r'''(connect! url port): <url> and <port> are strings.
+(connect! nodes): <nodes> is a list of "host:port" strings.
+Each request is sent to the node with the lowest latency.'''
+    if islist(url):
+        check_error(len(url) > 0, 'connect!: no node is given')
+        nodes = map(parse_node, url)
+    else:
+        nodes = [(url, port)]
+    buildin_values.nodes = nodes
+    buildin_values.url, buildin_values.port = nodes[0]
+    es_clients_clear()
+    return mkvoid()
+
+
+@tiesproc
+def set_es_pool_size(size):
+    r'''(set-es-pool-size! size):
+Set the number of keep-alive connections kept open to each node.'''
+    buildin_values.es_pool_size = size
+    es_clients_clear()
+    return mkvoid()
+
+
+@tiesproc
+def set_es_timeout(timeout):
+    r'''(set-es-timeout! timeout): <timeout> is in seconds.'''
+    buildin_values.es_timeout = timeout
+    es_clients_clear()
     return mkvoid()
 
 
@@ -126,9 +179,11 @@ def get_current_doc_type():
 
 
 def prompt():
-    host_info = '%s:%s/%s' % (
-        buildin_values.url, buildin_values.port, buildin_values.index,
-    )
+    host_info = '%s:%s' % (buildin_values.url, buildin_values.port)
+    n = len(buildin_values.nodes)
+    if n > 1:
+        host_info += '(+%s)' % (n - 1)
+    host_info = '%s/%s' % (host_info, buildin_values.index)
     buf = [yellow(host_info)]
     if not isvoid(buildin_values.doc_type):
         buf.append(yellow('/%s' % buildin_values.doc_type))
@@ -163,7 +218,7 @@ class ResponseList(list):
         self.additional_info = additional_info
 
     def __str__(self):
-        data_str = pprint.pformat(self)
+        data_str = pprint.pformat(map(unwrap, self))
         if self.additional_info is None:
             return data_str
         else:
@@ -171,15 +226,157 @@ class ResponseList(list):
             return '%s\n\nAdditional info:\n%s' % (data_str, addi_str)
 
 
+# the documents of the responses are read-only tables
+register_table_view(TableView, unwrap)
+
+
+@tiesproc
+def additional_info(response):
+    r'''(additional-info response):
+Returns the additional info (like the total number of hits) of
+the <response> of a search as a table.'''
+    check_error(isinstance(response, ResponseList),
+                'additional-info: expect the response of a search')
+    if response.additional_info is None:
+        return mktable()
+    return response.additional_info
+
+
 # functions for elasticsearch #############################
 
+# imported by the first request, they are slow to import
+ES = lazy_import('elasticsearch')
+espost = lazy_import('connection.espost')
+
+
+def es_client_classes():
+    r'''
+    Returns (TimedConnection, LatencySelector), the classes which extend
+    the ones of elasticsearch. They are defined by the first call.
+    '''
+    global __global_es_client_classes
+    if __global_es_client_classes is not None:
+        return __global_es_client_classes
+
+    class TimedConnection(ES.Urllib3HttpConnection):
+        r'''
+        A connection which keeps the moving averages of its latency
+        and error rate in <stats>.
+        '''
+        def __init__(self, *args, **kwargs):
+            super(TimedConnection, self).__init__(*args, **kwargs)
+            self.stats = NodeStats()
+
+        def perform_request(self, *args, **kwargs):
+            start = time.time()
+            try:
+                res = super(TimedConnection, self).perform_request(
+                    *args, **kwargs)
+            except ES.TransportError as e:
+                ok = not (isinstance(e, ES.ConnectionError) or
+                          (isinstance(e.status_code, int) and
+                           e.status_code >= 500))
+                self.stats.report(time.time() - start, ok)
+                raise
+            elapsed = time.time() - start
+            self.stats.report(elapsed, True)
+            record_phase('network', elapsed)
+            record_response_bytes(len(res[2]))
+            return res
+
+    class LatencySelector(ES.ConnectionSelector):
+        r'''
+        Selects the live connection with the best score.
+        '''
+        def select(self, connections):
+            return min(connections, key=lambda c: c.stats.score())
+
+    __global_es_client_classes = (TimedConnection, LatencySelector)
+    return __global_es_client_classes
+
+
+__global_es_client_classes = None
+
+
+class TimedSerializer(ESSerializer):
+    r'''
+    Records the time of serialization and decoding of the current query.
+    '''
+    def dumps(self, data):
+        return timed('serialize', super(TimedSerializer, self).dumps, data)
+
+    def loads(self, s):
+        return timed('decode', super(TimedSerializer, self).loads, s)
+
+
+# nodes => ES.Elasticsearch
+__global_es_clients = {}
+# nodes => NodeSet, for the requests which are not made by the client
+__global_node_sets = {}
+
+
+def es_client_key():
+    return tuple(buildin_values.nodes)
+
+
+def es_new_client():
+    TimedConnection, LatencySelector = es_client_classes()
+    return ES.Elasticsearch(
+        map(lambda (host, port): {'host': host, 'port': int(port)},
+            buildin_values.nodes),
+        maxsize=buildin_values.es_pool_size,
+        timeout=buildin_values.es_timeout,
+        serializer=TimedSerializer(),
+        connection_class=TimedConnection,
+        selector_class=LatencySelector,
+        dead_timeout=buildin_values.es_dead_timeout,
+        randomize_hosts=False)
+
+
+def es_close_client(es):
+    for conn in es.transport.connection_pool.connections:
+        pool = getattr(conn, 'pool', None)
+        if pool is not None:
+            pool.close()
+
+
+def es_clients_clear():
+    r'''
+    Drop all the cached clients. Called whenever the connection settings
+    change so that the next request builds a client with the new settings.
+    '''
+    for es in __global_es_clients.values():
+        es_close_client(es)
+    __global_es_clients.clear()
+    __global_node_sets.clear()
+
+
+def es_node_set():
+    key = es_client_key()
+    try:
+        return __global_node_sets[key]
+    except KeyError:
+        nodes = NodeSet(
+            map(lambda (host, port): 'http://%s:%s' % (host, port),
+                buildin_values.nodes),
+            cooldown=buildin_values.es_dead_timeout)
+        __global_node_sets[key] = nodes
+        return nodes
+
 
 def es_connect():
-    es = ES.Elasticsearch([{
-        'host': buildin_values.url,
-        'post': buildin_values.port,
-    }])
-    return es
+    r'''
+    Returns the client for the current nodes.
+    The client (and its pool of keep-alive connections) is reused by
+    all the following requests until the settings change.
+    '''
+    key = es_client_key()
+    try:
+        return __global_es_clients[key]
+    except KeyError:
+        es = es_new_client()
+        __global_es_clients[key] = es
+        return es
 
 
 @tiesproc
@@ -195,17 +392,384 @@ def es_search(post_data):
     r'''(es_search post_data):
 <post_data> is a translated data.
 This function returns the origin response'''
-    es = es_connect()
-    kwargs = {
-        'index': buildin_values.index,
-        'body': post_data,
-    }
+    return in_query('origin', do_es_search, post_data)
+
+
+def do_es_search(post_data):
+    kwargs = es_search_kwargs(post_data)
+    dbg_print('Post data:', post_data)
+    key = cache_key(post_data)
+    try:
+        orig = timed('cache', cache_get, key)
+        dbg_print('Cache hit:', key)
+    except KeyError:
+        orig = es_connect().search(**kwargs)
+        timed('cache', cache_put, key, orig, cache_ttl_for(post_data))
+    record_response(orig)
+    dbg_print('Get:', orig)
+    return timed('format', _format, orig)
+
+
+def run_search(parse, do_translate, response, args):
+    r'''
+    Parse <args>, translate, search and post-process the response.
+    The time of each phase is recorded in the current query.
+    '''
+    translate_args = timed('parse_args', parse, *args)
+    post_data = timed(
+        'translate', unpack_and_translate, do_translate, translate_args)
+    return timed('post_process', response, es_search(post_data))
+
+
+def es_search_path():
+    path = [buildin_values.index]
+    if not isvoid(buildin_values.doc_type):
+        path.append(buildin_values.doc_type)
+    return '/%s/_search' % '/'.join(path)
+
+
+def es_search_stream(post_data):
+    r'''
+    Returns an ArrayStream over the documents of the response of
+    <post_data>. The response is read and decoded incrementally, one
+    document at a time. The rest of the response is in its <rest>
+    after the iteration.
+    '''
+    dbg_print('Post data:', post_data)
+    chunks = espost.espost_stream(
+        es_search_path(), post_data, nodes=es_node_set())
+    return ArrayStream(chunks, ['hits', 'hits'])
+
+
+def es_target_kwargs():
+    kwargs = {'index': buildin_values.index}
     if not isvoid(buildin_values.doc_type):
         kwargs['doc_type'] = buildin_values.doc_type
+    return kwargs
+
+
+def es_search_kwargs(post_data):
+    kwargs = es_target_kwargs()
+    kwargs['body'] = post_data
+    return kwargs
+
+
+# query statistics ###
+__global_query_stats = QueryStats()
+
+
+def record_phase(phase, seconds):
+    __global_query_stats.add(phase, seconds)
+
+
+def record_response_bytes(n):
+    record = __global_query_stats.current()
+    if record is not None:
+        record.response_bytes += n
+
+
+def record_response(orig, record=None):
+    if record is None:
+        record = __global_query_stats.current()
+    if record is None:
+        return
+    took = orig.get('took')
+    if took is not None:
+        record.add('took', took / 1000.)
+    try:
+        hits = orig['hits']['total']
+    except KeyError:
+        return
+    record.hits = (record.hits or 0) + hits
+
+
+def timed(phase, func, *args):
+    return __global_query_stats.timed(phase, func, *args)
+
+
+def in_query(kind, func, *args):
+    r'''
+    Call func(*args) as a query of <kind>, whose statistics are recorded.
+    If a query is already running, func(*args) is a part of it.
+    '''
+    if __global_query_stats.current() is not None:
+        return func(*args)
+    record = __global_query_stats.begin(kind)
+    try:
+        return func(*args)
+    finally:
+        __global_query_stats.end(record)
+        dbg_print('Query stats:', record.to_table())
+
+
+@tiesproc
+def query_stats(*kinds):
+    r'''(query-stats kind ...):
+Returns the percentiles of the latency and of each phase (in milliseconds),
+the response size and the hits of the recent queries of each <kind>
+(e.g. "hits", "scroll", "terms", "histogram", "msearch" or "origin").
+All the kinds by default.'''
+    stats = __global_query_stats.summary()
+    if len(kinds) == 0:
+        return stats
+    return Table(dict(filter(lambda (k, v): k in kinds, stats.items())))
+
+
+@tiesproc
+def query_stats_clear():
+    r'''(query-stats-clear!): Forget all the recorded queries.'''
+    __global_query_stats.clear()
+    return mkvoid()
+
+
+# query cache ###
+buildin_values.cache_enabled = True
+buildin_values.cache_size = 100
+buildin_values.cache_ttl = 60
+buildin_values.cache_file = None
+###
+
+__global_query_cache = LRUCache(buildin_values.cache_size)
+__global_disk_cache = None
+
+
+def cache_key(post_data):
+    r'''
+    (host, index, doc_type, canonical JSON of <post_data>)
+    The key must be the same in every process for the disk cache.
+    '''
+    doc_type = buildin_values.doc_type
+    if isvoid(doc_type):
+        doc_type = ''
+    return '%s/%s/%s\n%s' % (
+        ','.join(map(lambda n: '%s:%s' % n, buildin_values.nodes)),
+        buildin_values.index, doc_type,
+        json_dumps(post_data, sort_keys=True))
+
+
+def cache_get(key):
+    r'''
+    May throw KeyError
+    The results share the data of the cached response through read-only
+    views, so it is not copied.
+    '''
+    if not buildin_values.cache_enabled:
+        raise KeyError(key)
+    try:
+        data = __global_query_cache.get(key)
+    except KeyError:
+        disk = __global_disk_cache
+        if disk is None:
+            raise
+        data = disk.get(key)
+        __global_query_cache.put(key, data, disk.ttl(key))
+    return data
+
+
+def cache_put(key, orig, ttl):
+    if not buildin_values.cache_enabled:
+        return
+    __global_query_cache.put(key, orig, ttl)
+    disk = __global_disk_cache
+    if disk is not None:
+        disk.put(key, orig, ttl)
+
+
+def range_ends(cond):
+    r'''
+    Returns the ends of the top-level range conditions of <cond>.
+    '''
+    if 'range' in cond:
+        return map(lambda r: r.get('lt', r.get('lte')),
+                   cond['range'].values())
+    elif 'filtered' in cond:
+        return (range_ends(cond['filtered']['query']) +
+                range_ends(cond['filtered']['filter']))
+    elif 'and' in cond:
+        return sum(map(range_ends, cond['and']), [])
+    else:
+        return []
+
+
+def is_in_past(post_data):
+    r'''
+    Returns true if the query is restricted by a time range which is
+    fully in the past, i.e. the result will never change.
+    '''
+    current = now()
+    for end in range_ends(post_data.get('query', {})):
+        if (isinstance(end, datetime) and end.tzinfo is not None and
+                end <= current):
+            return True
+    return False
+
+
+def cache_ttl_for(post_data):
+    if is_in_past(post_data):
+        return None
+    return buildin_values.cache_ttl
+
+
+@tiesproc
+def cache_stats():
+    r'''(cache-stats): Returns the statistics of the query cache.'''
+    stats = Table()
+    stats.enabled = buildin_values.cache_enabled
+    stats.size = len(__global_query_cache)
+    stats.max_size = __global_query_cache.maxsize
+    stats.ttl = buildin_values.cache_ttl
+    stats.hits = __global_query_cache.hits
+    stats.misses = __global_query_cache.misses
+    disk = __global_disk_cache
+    if disk is not None:
+        stats.file = disk.filename
+        stats.file_size = len(disk)
+        stats.file_hits = disk.hits
+        stats.file_misses = disk.misses
+    return stats
+
+
+@tiesproc
+def cache_clear():
+    r'''(cache-clear!): Removes all the cached responses.'''
+    __global_query_cache.clear()
+    disk = __global_disk_cache
+    if disk is not None:
+        disk.clear()
+    return mkvoid()
+
+
+@tiesproc
+def cache_on():
+    buildin_values.cache_enabled = True
+    return mkvoid()
+
+
+@tiesproc
+def cache_off():
+    buildin_values.cache_enabled = False
+    return mkvoid()
+
+
+@tiesproc
+def set_cache_size(size):
+    r'''(set-cache-size! size):
+Set the max number of responses kept in memory.'''
+    buildin_values.cache_size = size
+    __global_query_cache.resize(size)
+    return mkvoid()
+
+
+@tiesproc
+def set_cache_ttl(ttl):
+    r'''(set-cache-ttl! ttl): <ttl> is in seconds.
+The responses of queries in the past never expire.'''
+    buildin_values.cache_ttl = ttl
+    return mkvoid()
+
+
+@tiesproc
+def set_cache_file(fn):
+    r'''(set-cache-file! fn):
+Also keep the responses in file <fn> so that they survive restarts.
+(set-cache-file! (void)) closes the file.'''
+    global __global_disk_cache
+    if __global_disk_cache is not None:
+        __global_disk_cache.close()
+        __global_disk_cache = None
+    if isvoid(fn):
+        buildin_values.cache_file = None
+    else:
+        buildin_values.cache_file = fn
+        __global_disk_cache = DiskCache(fn)
+    return mkvoid()
+
+
+def prefetch(func, *args):
+    r'''
+    Run func(*args) in a background thread.
+    Returns a function which waits for and returns the result
+    (or re-raises the exception raised by <func>).
+    '''
+    result = {}
+
+    def run():
+        try:
+            result['value'] = func(*args)
+        except Exception:
+            result['error'] = sys.exc_info()
+
+    t = threading.Thread(target=run)
+    t.daemon = True
+    t.start()
+
+    def wait():
+        t.join()
+        if 'error' in result:
+            exc_type, exc_value, exc_tb = result['error']
+            raise exc_type, exc_value, exc_tb
+        return result['value']
+
+    return wait
+
+
+# environment for scroll ###
+buildin_values.scroll_keep_alive = '1m'
+###
+
+
+def es_scroll(post_data, record):
+    r'''
+    A generator which yields the formatted pages of the scroll over
+    <post_data>. The next page is fetched in background while the
+    current one is consumed, so at most two pages are held in memory.
+    The fetches of the pages are timed in the query <record>.
+    '''
+    es = es_connect()
+    keep_alive = buildin_values.scroll_keep_alive
+    kwargs = es_search_kwargs(post_data)
+    kwargs['scroll'] = keep_alive
     dbg_print('Post data:', post_data)
-    res = _format(es.search(**kwargs))
-    dbg_print('Get:', res)
-    return res
+    page = __global_query_stats.within(
+        record, scroll_page, record, es.search, kwargs)
+    scroll_id = page._scroll_id
+    next_page = None
+    try:
+        while len(page.hits.hits) > 0:
+            next_page = prefetch(
+                __global_query_stats.within, record, scroll_page, record,
+                es.scroll, {'scroll_id': scroll_id, 'scroll': keep_alive})
+            yield page
+            page = next_page()
+            next_page = None
+            scroll_id = page._scroll_id
+    finally:
+        if next_page is not None:
+            try:
+                scroll_id = next_page()._scroll_id
+            except ES.TransportError:
+                pass
+        try:
+            es.clear_scroll(scroll_id=scroll_id)
+        except ES.TransportError:
+            pass
+
+
+def scroll_page(record, request, kwargs):
+    r'''
+    Returns the formatted page of request(**kwargs), a search or a scroll.
+    The hits of <record> are the total of the first page.
+    '''
+    orig = request(**kwargs)
+    took = orig.get('took')
+    if took is not None:
+        record.add('took', took / 1000.)
+    if record.hits is None:
+        try:
+            record.hits = orig['hits']['total']
+        except KeyError:
+            pass
+    return timed('format', _format, orig)
 
 
 class MissingArgument(object):
@@ -284,7 +848,11 @@ def parse_args(template, *args):
         translate_args = add_default(
             args, map(lambda t: get_buildin_value_or_self(t[2]), template))
     check_missing(translate_args)
-    return translate_args
+    # the lists made by cons and cdr are given to the translator
+    # as lists in python
+    if isinstance(translate_args, list):
+        return map(list_topython, translate_args)
+    return dict((k, list_topython(v)) for k, v in translate_args.iteritems())
 
 
 def unpack_and_translate(do_translate_func, translate_args):
@@ -344,12 +912,95 @@ def translate_hits(*args):
 
 @tiesproc
 def search_hits(*args):
-    orig = es_search(translate_hits(*args))
+    return in_query('hits', run_search, hits_parse_args, do_translate_hits,
+                    hits_response, args)
+
+
+def hits_response(orig):
     data = hits_sources(orig)
     addi = hits_additional_info(orig)
     return ResponseList(data, addi)
 
 
+def search_hits_iter(*args):
+    r'''
+    Python API. Takes the same arguments as search-hits and yields the
+    documents one by one while the response is still being read, so only
+    one document is decoded at a time.
+    The documents of a cached response are taken from the query cache.
+    Otherwise the response is streamed with the pooled sessions of
+    connection.espost, since the client of elasticsearch reads the whole
+    response, and it is not cached, which would keep all the documents
+    in memory. The query is recorded as a query of "hits" when the
+    iteration ends.
+    '''
+    record = QueryRecord('hits')
+    try:
+        translate_args = record.timed('parse_args', hits_parse_args, *args)
+        post_data = record.timed(
+            'translate', unpack_and_translate, do_translate_hits,
+            translate_args)
+        try:
+            orig = record.timed('cache', cache_get, cache_key(post_data))
+            docs = orig['hits']['hits']
+        except KeyError:
+            orig = None
+            docs = record.timed('network', es_search_stream, post_data)
+    except BaseException:
+        __global_query_stats.end(record)
+        raise
+    return iter_recorded_hits(record, orig, docs)
+
+
+def iter_recorded_hits(record, orig, docs):
+    r'''
+    Yields the sources of <docs>, the documents of the response <orig>,
+    or an ArrayStream if <orig> is None, and ends the query <record>.
+    '''
+    try:
+        for doc in iter_hits_sources(docs):
+            yield doc
+        if orig is None:
+            orig = docs.rest
+        record_response(orig, record)
+    finally:
+        __global_query_stats.end(record)
+
+
+def stream_hits_iter(*args):
+    r'''
+    Python API of stream-hits.
+    Takes the same arguments as search-hits and yields the documents
+    one by one, walking all the matching documents with the scroll API.
+    <size> is the number of documents fetched per page (per shard).
+    The scroll is recorded as a query of "scroll" when it ends.
+    '''
+    record = QueryRecord('scroll')
+    try:
+        translate_args = record.timed('parse_args', hits_parse_args, *args)
+        post_data = record.timed(
+            'translate', unpack_and_translate, do_translate_hits,
+            translate_args)
+        for page in es_scroll(post_data, record):
+            for doc in record.timed('post_process', hits_sources, page):
+                yield doc
+    finally:
+        __global_query_stats.end(record)
+
+
+@tiesproc
+def stream_hits(proc, *args):
+    r'''(stream-hits proc args ...):
+Apply <proc> to every document matching <args> and return
+the number of documents. <args> are the same as search-hits.
+All the matching documents are visited page by page.'''
+    count = 0
+    for doc in stream_hits_iter(*args):
+        _apply(proc, mklist(doc))
+        count += 1
+    return count
+
+
 # terms ###
 __GLOBAL_TERMS_TAGS = '__terms__'
 
@@ -385,7 +1036,11 @@ def translate_terms(*args):
 
 @tiesproc
 def search_terms(*args):
-    orig = es_search(translate_terms(*args))
+    return in_query('terms', run_search, terms_parse_args,
+                    do_translate_terms, terms_response, args)
+
+
+def terms_response(orig):
     data = facet_terms(__GLOBAL_TERMS_TAGS, orig)
     addi = facet_terms_additional_info(__GLOBAL_TERMS_TAGS, orig)
     return ResponseList(data, addi)
@@ -429,12 +1084,73 @@ def translate_histogram(*args):
 
 @tiesproc
 def search_histogram(*args):
-    orig = es_search(translate_histogram(*args))
+    return in_query('histogram', run_search, histogram_parse_args,
+                    do_translate_histogram, histogram_response, args)
+
+
+def histogram_response(orig):
     data = facet_entries(__GLOBAL_HISTOGRAM_TAGS, orig)
     # histogram has no additional info
     return ResponseList(data)
 
 
+# multi-search ###
+
+
+def es_msearch(post_data_list):
+    r'''
+    Send all the bodies in <post_data_list> in one _msearch request.
+    Returns the origin responses in the same order.
+    '''
+    es = es_connect()
+    kwargs = es_target_kwargs()
+    lines = []
+    for post_data in post_data_list:
+        lines.append({})
+        lines.append(post_data)
+    dbg_print('Post data:', lines)
+    responses = es.msearch(body=lines, **kwargs)['responses']
+    res = []
+    for r in responses:
+        check_error('error' not in r, 'msearch: %s' % r.get('error'))
+        record_response(r)
+        res.append(timed('format', _format, r))
+    dbg_print('Get:', responses)
+    return res
+
+
+def response_for(post_data):
+    r'''
+    Returns the function which post-processes the response of <post_data>.
+    <post_data> is made by translate-hits, translate-terms or
+    translate-histogram.
+    '''
+    facets = post_data.get('facets', {})
+    if __GLOBAL_TERMS_TAGS in facets:
+        return terms_response
+    elif __GLOBAL_HISTOGRAM_TAGS in facets:
+        return histogram_response
+    else:
+        return hits_response
+
+
+@tiesproc
+def msearch(*post_data_list):
+    r'''(msearch q ...):
+<q>s are made by translate-hits, translate-terms or translate-histogram.
+Send all the <q>s in one request and returns the list of the results,
+the same as search-hits, search-terms or search-histogram would return.'''
+    return in_query('msearch', do_msearch, post_data_list)
+
+
+def do_msearch(post_data_list):
+    origs = es_msearch(post_data_list)
+    return mklist(*map(
+        lambda (post_data, orig): timed(
+            'post_process', response_for(post_data), orig),
+        zip(post_data_list, origs)))
+
+
 __global_all_templates = [
     ('hits', [
         ('\'s', 'size', 'hits_default_size'),
@@ -543,7 +1259,7 @@ def show_default_args(*keys):
 
 
 import common.timeutils as tt
-from datetime import timedelta
+from datetime import datetime, timedelta
 
 
 @tiesproc
@@ -594,23 +1310,39 @@ def ties_primitive_procedures():
         ('get-current-index', get_current_index, eq_to(0)),
         ('set-current-doc-type!', set_current_doc_type, eq_to(1)),
         ('get-current-doc-type', get_current_doc_type, eq_to(0)),
+        ('set-es-pool-size!', set_es_pool_size, eq_to(1)),
+        ('set-es-timeout!', set_es_timeout, eq_to(1)),
         # conditions
-        ('Equal', Equal, eq_to(2)),
-        ('Range', Range, eq_to(3)),
-        ('Prefix', Prefix, eq_to(2)),
-        ('And', lambda *conds: And(conds), ge_than(1)),
-        ('Or', lambda *conds: Or(conds), ge_than(1)),
-        ('Not', Not, eq_to(1)),
+        ('Equal', Equal, eq_to(2), PURE),
+        ('Range', Range, eq_to(3), PURE),
+        ('Prefix', Prefix, eq_to(2), PURE),
+        ('And', lambda *conds: And(conds), ge_than(1), PURE),
+        ('Or', lambda *conds: Or(conds), ge_than(1), PURE),
+        ('Not', Not, eq_to(1), PURE),
         # translate and search
         ('list-indices', list_indices, eq_to(0)),
-        ('Sort', Sort, inrange(1, 2)),
+        ('additional-info', additional_info, eq_to(1)),
+        ('Sort', Sort, inrange(1, 2), PURE),
         ('origin-search', es_search, eq_to(1)),
         ('translate-hits', translate_hits, _any),
         ('search-hits', search_hits, _any),
+        ('stream-hits', stream_hits, ge_than(1)),
         ('translate-terms', translate_terms, _any),
         ('search-terms', search_terms, _any),
         ('translate-histogram', translate_histogram, _any),
         ('search-histogram', search_histogram, _any),
+        ('msearch', msearch, _any),
+        # query statistics
+        ('query-stats', query_stats, _any),
+        ('query-stats-clear!', query_stats_clear, eq_to(0)),
+        # query cache
+        ('cache-stats', cache_stats, eq_to(0)),
+        ('cache-clear!', cache_clear, eq_to(0)),
+        ('cache-on', cache_on, eq_to(0)),
+        ('cache-off', cache_off, eq_to(0)),
+        ('set-cache-size!', set_cache_size, eq_to(1)),
+        ('set-cache-ttl!', set_cache_ttl, eq_to(1)),
+        ('set-cache-file!', set_cache_file, eq_to(1)),
         # default arguments
         ('show-default-args', show_default_args, _any),
         ('get-condition', get_conditions, eq_to(0)),
@@ -625,16 +1357,19 @@ def ties_primitive_procedures():
         ('set-histogram-interval', set_histogram_interval, eq_to(1)),
         # datetime
         ('now', now, eq_to(0)),
-        ('minutes', minutes, eq_to(1)),
-        ('hours', hours, eq_to(1)),
-        ('days', days, eq_to(1)),
+        ('minutes', minutes, eq_to(1), PURE),
+        ('hours', hours, eq_to(1), PURE),
+        ('days', days, eq_to(1), PURE),
         # short cuts for conditions
         ('Range-hours-ago', range_hours_ago, eq_to(2)),
     ]
-    return map(lambda (s, b, a): (s, mkprimitive(s, a, b)), PM)
+    return mkprimitives(PM)
+
+
+__global_ties_primitives = register_primitives(ties_primitive_procedures())
 
 
 def setup_ties_environment():
     env = setup_environment()
-    env.putall(ties_primitive_procedures())
+    env.putall(__global_ties_primitives)
     return env
@@ -1,10 +1,15 @@
 #
 
-from common.container import Table, Buckets
+from common.container import Table, TableView, Buckets, view, unwrap
 
 
 def _format(origin_data):
-    return Table(origin_data)
+    '''
+    Returns a view of <origin_data>. Nothing is copied.
+    The data returned by the functions below are views of the parts of
+    <origin_data>, which have the same attribute access as Table.
+    '''
+    return TableView(origin_data)
 
 
 def hits_additional_info(formatted_data):
@@ -23,16 +28,30 @@ def hits_sources(formatted_data):
         return formatted_data['hits']['hits']['fields']
     '''
 
-    def get_source_or_fields(doc):
-        try:
-            return doc._source
-        except AttributeError:
-            try:
-                return doc.fields
-            except AttributeError:
-                return {}
+    return map(lambda doc: view(source_or_fields(doc)),
+               unwrap(formatted_data.hits.hits))
+
+
+def iter_hits_sources(docs):
+    '''
+    The same as hits_sources but takes an iterable of the origin documents
+    (the elements of ['hits']['hits']) and yields the results one by one.
+    '''
+    for doc in docs:
+        yield view(source_or_fields(doc))
+
 
-    return map(get_source_or_fields, formatted_data.hits.hits)
+def source_or_fields(doc):
+    '''
+    <doc> is an origin document.
+    '''
+    try:
+        return doc['_source']
+    except KeyError:
+        try:
+            return doc['fields']
+        except KeyError:
+            return {}
 
 
 def facet_terms_additional_info(name, formatted_data):
@@ -52,14 +71,14 @@ def facet_terms(name, formatted_data):
     '''
         return formatted_data['facets'][name]['terms']
     '''
-    return formatted_data.facets[name].terms
+    return list(formatted_data.facets[name].terms)
 
 
 def facet_entries(name, formatted_data):
     '''
         return formatted_data['facets'][name]['entries']
     '''
-    return formatted_data.facets[name].entries
+    return list(formatted_data.facets[name].entries)
 
 
 def groupby_func(data, func):